@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+
+default_settings = {
+    "OBS_HOST": "localhost",
+    "OBS_PORT": "",
+    "OBS_PASSWORD": "",
+    "OBS_DIRECTORY": "",
+    "TIMEOUT": "60",
+    "CONCATENATE_OUTPUTS": True,
+    "DELETE_ORIGINALS": True,
+    "LOG_DIR": "",
+    "LOG_IDLE_WINDOW": "86400",
+    "OUTPUT_DIR": "",
+    "TRIGGER_RULES": [
+        {"pattern": "(combat)"},
+        {"pattern": "has applied bonuses to"}
+    ],
+    "TRIGGER_THRESHOLD": "1",
+    "POLL_INTERVAL_IDLE": "2",
+    "POLL_INTERVAL_COMBAT": "0.25",
+    "PROCESSING_WORKERS": "2",
+    "PROCESSING_QUIET_PERIOD": "60",
+    "PROCESSING_READ_RATE": "0",
+    "LIBRARY_MAX_GB": "0",
+    "LIBRARY_MAX_AGE_DAYS": "0",
+    "LIBRARY_REENCODE_AFTER_DAYS": "0",
+    "LIBRARY_REENCODE_CODEC": "libx265",
+    "LIBRARY_REENCODE_CRF": "28",
+    "METRICS_PORT": "0",
+    "METRICS_SNAPSHOT_INTERVAL": "60",
+    "FFMPEG_URL": "",
+    "FFMPEG_SHA256": ""
+}
+
+
+def app_paths():
+    """(packaged, base_path, files_path)
+
+    base_path holds the bundled resources, files_path the settings, logs and state files next to the exe or script.
+    """
+    packaged = getattr(sys, 'frozen', False)
+    if packaged:
+        return packaged, sys._MEIPASS, os.path.dirname(sys.executable)
+    return packaged, os.path.abspath("."), os.path.dirname(os.path.abspath(__file__))
+
+
+def load_settings(settings_path, logger):
+    """Load the settings, keys that do not exist get their default
+
+    :return settings and true if defaults were added and should be saved
+    """
+    try:
+        with open(settings_path, 'r') as f:
+            settings = json.load(f)
+        logger.info("Loaded settings.")
+    except FileNotFoundError:
+        settings = {}
+        logger.warning("Loading settings failed, running defaults.")
+
+    has_changed = False
+    for key, value in default_settings.items():
+        if key not in settings:
+            settings[key] = value
+            has_changed = True
+    return settings, has_changed
+
+
+def save_settings(settings_path, settings):
+    with open(settings_path, 'w') as f:
+        json.dump(settings, f, indent=2)
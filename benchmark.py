@@ -0,0 +1,262 @@
+"""Throughput benchmark for the LogReader hot paths
+
+Generates a realistic gamelog directory (many stale files, some active ones, bursty combat spam)
+and measures add_new_files, read_incrementally and check_files. With --obs the OBS request round trips
+of TimeoutRecording are measured against the local fake OBS server as well. Results are printed as json
+so they can be compared between runs, e.g.:
+
+    python benchmark.py --obs --output bench.json
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from logreader import LogReader
+
+header = (
+    "------------------------------------------------------------\n"
+    "  Gamelog\n"
+    "  Listener: {character}\n"
+    "  Session Started: {timestamp}\n"
+    "------------------------------------------------------------\n"
+)
+
+line_templates = [
+    "[ {timestamp} ] (combat) <color=0xff00ffff><b>{amount}</b> <color=0x77ffffff><font size=10>to</font> "
+    "<b><color=0xffffffff>{enemy}</b><font size=10><color=0x77ffffff> - Heavy Missile - Hits\n",
+    "[ {timestamp} ] (combat) <color=0xffcc0000><b>{amount}</b> <color=0x77ffffff><font size=10>from</font> "
+    "<b><color=0xffffffff>{enemy}</b><font size=10><color=0x77ffffff> - Small Autocannon - Smashes\n",
+    "[ {timestamp} ] (combat) <color=0xffffffff><b>Warp scramble attempt</b> <color=0x77ffffff><font size=10>"
+    "from</font> <b>you</b> <color=0x77ffffff><font size=10>to </font><b><color=0xffffffff>{enemy}</b>\n",
+    "[ {timestamp} ] (notify) Fleet Bôss has applied bonuses to 12 fleet members.\n",
+    "[ {timestamp} ] (notify) Your cloak deactivates due to a pulse from a Mobile Observatory.\n",
+    "[ {timestamp} ] (hint) Attempting to join a channel\n",
+]
+
+enemies = ["Hostile Pïlot[CORP](Loki)", "Ωmega Dude[ABC](Rifter)", "Someone Else[XYZ](Sabre)"]
+
+
+def timestamp_now():
+    return datetime.datetime.now().strftime("%Y.%m.%d %H:%M:%S")
+
+
+def make_lines(count, rng):
+    timestamp = timestamp_now()
+    return "".join(
+        rng.choice(line_templates).format(timestamp=timestamp, amount=rng.randint(1, 3000), enemy=rng.choice(enemies))
+        for _ in range(count)
+    )
+
+
+def generate_directory(directory, stale_files, active_files, rng):
+    """Fill a directory with stale and active gamelogs, return the paths of the active ones"""
+    stale_time = time.time() - 7 * 24 * 60 * 60
+    for i in range(stale_files):
+        file_path = os.path.join(directory, f"20240101_000000_{90000000 + i}.txt")
+        with open(file_path, 'w', encoding="utf8") as f:
+            f.write(header.format(character=f"Old Character {i}", timestamp=timestamp_now()))
+            f.write(make_lines(20, rng))
+        os.utime(file_path, (stale_time, stale_time))
+
+    active_paths = []
+    for i in range(active_files):
+        file_path = os.path.join(directory, f"20240102_000000_{10000000 + i}.txt")
+        with open(file_path, 'w', encoding="utf8") as f:
+            f.write(header.format(character=f"Fleet Mèmber {i}", timestamp=timestamp_now()))
+        active_paths.append(file_path)
+    return active_paths
+
+
+def append_burst(active_paths, lines_per_file, rng):
+    """Append combat spam to all active files, return the number of bytes written"""
+    written = 0
+    for file_path in active_paths:
+        data = make_lines(lines_per_file, rng).encode("utf8")
+        with open(file_path, 'ab') as f:
+            f.write(data)
+        written += len(data)
+    return written
+
+
+def summarize(durations):
+    durations = sorted(durations)
+    return {
+        "polls": len(durations),
+        "mean_ms": statistics.mean(durations) * 1000,
+        "p50_ms": durations[len(durations) // 2] * 1000,
+        "p95_ms": durations[int(len(durations) * 0.95)] * 1000,
+        "max_ms": durations[-1] * 1000,
+    }
+
+
+def bench_add_new_files(directory, polls):
+    reader = LogReader(directory)
+    durations = []
+    for _ in range(polls):
+        # Force a full directory scan every time
+        reader.directory_mtime = None
+        start = time.perf_counter()
+        reader.add_new_files()
+        durations.append(time.perf_counter() - start)
+    reader.close()
+
+    result = summarize(durations)
+    result["files_in_directory"] = len(os.listdir(directory))
+    result["files_observed"] = len(reader.observed_files)
+    return result
+
+
+def bench_read_incrementally(directory, active_paths, polls, lines_per_file, rng):
+    reader = LogReader(directory)
+    durations = []
+    total_bytes = 0
+    total_lines = 0
+    for _ in range(polls):
+        total_bytes += append_burst(active_paths, lines_per_file, rng)
+        total_lines += lines_per_file * len(active_paths)
+        start = time.perf_counter()
+        for file_path in active_paths:
+            reader.read_incrementally(file_path)
+        durations.append(time.perf_counter() - start)
+    reader.close()
+
+    result = summarize(durations)
+    result["lines_per_second"] = total_lines / sum(durations)
+    result["bytes_per_second"] = total_bytes / sum(durations)
+    return result
+
+
+def bench_check_files(directory, active_paths, polls, lines_per_file, rng):
+    reader = LogReader(directory)
+    durations = []
+    total_bytes = 0
+    total_lines = 0
+    for _ in range(polls):
+        total_bytes += append_burst(active_paths, lines_per_file, rng)
+        total_lines += lines_per_file * len(active_paths)
+        start = time.perf_counter()
+        reader.check_files()
+        durations.append(time.perf_counter() - start)
+
+    # Measure memory on a separate poll, tracing would distort the timings above
+    append_burst(active_paths, lines_per_file, rng)
+    tracemalloc.start()
+    reader.check_files()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # An idle poll, nothing was written since the last one
+    start = time.perf_counter()
+    reader.check_files()
+    idle_duration = time.perf_counter() - start
+    reader.close()
+
+    result = summarize(durations)
+    result["lines_per_second"] = total_lines / sum(durations)
+    result["bytes_per_second"] = total_bytes / sum(durations)
+    result["idle_poll_ms"] = idle_duration * 1000
+    result["peak_memory_bytes"] = peak_memory
+    return result
+
+
+def bench_obs_requests(cycles, latency):
+    """Measure OBS request round trips and reconnect time against the fake OBS server"""
+    # Imported here so the log benchmarks run without obsws-python installed
+    import logging
+    from fake_obs import FakeObsServer
+    from obs_connection import ObsConnection
+    from recorder import TimeoutRecording
+
+    server = FakeObsServer(port=0, latency=latency).start()
+    logger = logging.getLogger("benchmark")
+    connection = ObsConnection("localhost", server.port, "", logger, probe_interval=0.1).start()
+    try:
+        connection.wait_connected(10)
+        recorder = TimeoutRecording(connection, logger, timeout=0)
+
+        set_timeout_durations = []
+        round_trip_durations = {}
+        for _ in range(cycles):
+            start = time.perf_counter()
+            recorder.set_timeout()
+            set_timeout_durations.append(time.perf_counter() - start)
+
+            recorder.check_timeout()
+            recorder.session.wait(5)
+            connection.flush()
+            for name in ("start_record", "save_replay_buffer", "stop_record"):
+                round_trip_durations.setdefault(name, []).append(connection.round_trip_times[name])
+        recorder.close()
+
+        # Simulate an OBS crash and measure how long it takes to notice and reconnect
+        crash_time = time.perf_counter()
+        server.disconnect_all()
+        while connection.connected.is_set() and time.perf_counter() - crash_time < 10:
+            time.sleep(0.001)
+        connection.wait_connected(60)
+        recovery_duration = time.perf_counter() - crash_time
+    finally:
+        connection.close()
+        server.stop()
+
+    return {
+        "server_latency_ms": latency * 1000,
+        "connect_ms": connection.connect_duration * 1000,
+        "probe_latency_ms": connection.probe_latency * 1000 if connection.probe_latency is not None else None,
+        "crash_recovery_ms": recovery_duration * 1000,
+        "set_timeout": summarize(set_timeout_durations),
+        "round_trips": {name: summarize(durations) for name, durations in round_trip_durations.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the LogReader hot paths")
+    parser.add_argument("--stale-files", type=int, default=5000)
+    parser.add_argument("--active-files", type=int, default=50)
+    parser.add_argument("--lines-per-poll", type=int, default=200, help="lines appended per active file per poll")
+    parser.add_argument("--polls", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--obs", action="store_true", help="also benchmark OBS requests against the fake OBS server")
+    parser.add_argument("--obs-latency", type=float, default=0.0, help="response latency of the fake OBS server")
+    parser.add_argument("--output", help="write results to this file instead of stdout")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    directory = tempfile.mkdtemp(prefix="gamelogs_")
+    try:
+        active_paths = generate_directory(directory, args.stale_files, args.active_files, rng)
+
+        results = {
+            "python": sys.version.split()[0],
+            "platform": sys.platform,
+            "parameters": vars(args),
+            "add_new_files": bench_add_new_files(directory, args.polls),
+            "read_incrementally": bench_read_incrementally(
+                directory, active_paths, args.polls, args.lines_per_poll, rng
+            ),
+            "check_files": bench_check_files(directory, active_paths, args.polls, args.lines_per_poll, rng),
+        }
+    finally:
+        shutil.rmtree(directory)
+
+    if args.obs:
+        results["obs_requests"] = bench_obs_requests(args.polls, args.obs_latency)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import datetime
+import re
+from enum import Enum
+
+
+class CombatEventKind(Enum):
+    DAMAGE_DEALT = 1
+    DAMAGE_RECEIVED = 2
+    MODULE_ACTIVATION = 3
+    BONUSES_APPLIED = 4
+
+
+class CombatEvent:
+    """A single interesting line of a gamelog"""
+    __slots__ = ("timestamp", "character", "file_path", "kind", "counterparty", "amount", "weight", "extension")
+
+    def __init__(self, timestamp, character, file_path, kind, counterparty, amount, weight=1, extension=0):
+        self.timestamp = timestamp
+        self.character = character
+        self.file_path = file_path
+        self.kind = kind
+        self.counterparty = counterparty
+        self.amount = amount
+        self.weight = weight
+        self.extension = extension
+
+    def __repr__(self):
+        return (f"CombatEvent({self.timestamp}, {self.character!r}, {self.kind.name}, "
+                f"{self.counterparty!r}, {self.amount})")
+
+
+line_regex = re.compile(r'^\[ (\d{4}\.\d\d\.\d\d \d\d:\d\d:\d\d) \] \((\w+)\) (.*)$')
+tag_regex = re.compile(r'<[^>]*>')
+damage_regex = re.compile(r'^(\d+) (to|from) (.+?)(?: - |$)')
+counterparty_regex = re.compile(r' (?:to|from) (.+?)(?= (?:to|from) | - |!|$)')
+listener_regex = re.compile(rb'Listener: ([^\r\n]+)')
+
+
+def parse_timestamp(text):
+    """Parse a gamelog timestamp (2024.01.01 12:00:00), much cheaper than strptime"""
+    return datetime.datetime(
+        int(text[0:4]), int(text[5:7]), int(text[8:10]),
+        int(text[11:13]), int(text[14:16]), int(text[17:19])
+    )
+
+
+def parse_listener(header):
+    """Get the character name from the first bytes of a gamelog"""
+    match = listener_regex.search(header)
+    if match is None:
+        return None
+    return match.group(1).strip().decode("utf8", errors="replace")
+
+
+def parse_line(line, character, file_path):
+    """Parse an interesting gamelog line into a CombatEvent, returns None if the line is not understood"""
+    match = line_regex.match(line)
+    if match is None:
+        return None
+
+    timestamp = parse_timestamp(match.group(1))
+    text = tag_regex.sub("", match.group(3)).strip()
+
+    if "has applied bonuses to" in text:
+        counterparty = text.split(" has applied bonuses to", 1)[0]
+        return CombatEvent(timestamp, character, file_path, CombatEventKind.BONUSES_APPLIED, counterparty, None)
+
+    damage = damage_regex.match(text)
+    if damage is not None:
+        if damage.group(2) == "to":
+            kind = CombatEventKind.DAMAGE_DEALT
+        else:
+            kind = CombatEventKind.DAMAGE_RECEIVED
+        return CombatEvent(timestamp, character, file_path, kind, damage.group(3).strip(), int(damage.group(1)))
+
+    # Module lines name both sides (e.g. "from you to X"), the counterparty is whoever is not us
+    counterparty = None
+    for party in counterparty_regex.findall(text):
+        if party.strip().lower() != "you":
+            counterparty = party.strip()
+            break
+    return CombatEvent(timestamp, character, file_path, CombatEventKind.MODULE_ACTIVATION, counterparty, None)
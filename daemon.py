@@ -0,0 +1,102 @@
+"""Headless Fight Recorder, runs the listener and the video pipeline from settings.json without any window
+
+    python daemon.py [--settings settings.json] [--profile [TRACE_FILE]] [--log-file main.log]
+
+or "Fight Recorder.exe --headless ..." for the packaged exe. Nothing slow happens before the logs are watched, the
+OBS connection, ffmpeg and the output library come up in the background. Stops on Ctrl+C or SIGTERM.
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+import tracing
+from app_settings import app_paths, load_settings, save_settings
+from listener_thread import RecordingStatusCallback
+from service import RecorderService
+from video_processing import ProcessingStatusCallback
+
+error_messages = (RecordingStatusCallback.RECORDING_ERROR, ProcessingStatusCallback.PROCESSING_ERROR)
+
+
+def log_status(logger, message):
+    """Status messages only go to the log, there is nothing else to show them"""
+    if type(message) is tuple and message[0] in error_messages:
+        error = message[1] if len(message) > 1 else None
+        exc_info = error if isinstance(error, BaseException) else None
+        logger.error(f"Got error status message: {message}", exc_info=exc_info)
+    elif message in error_messages:
+        logger.error(f"Got error status message {message} (without more details).")
+    elif type(message) is tuple and message[0] == ProcessingStatusCallback.PROCESSING_PROGRESS:
+        logger.debug(f"Got progress message: {message[1]}.")
+    else:
+        logger.info(f"Got status message: {message}.")
+
+
+def main(argv=None):
+    started_at = time.perf_counter()
+    packaged, base_path, files_path = app_paths()
+
+    parser = argparse.ArgumentParser(description="Record fights without the settings window")
+    parser.add_argument("--settings", default=os.path.join(files_path, "settings.json"),
+                        help="settings file, missing keys get their defaults (default: settings.json)")
+    parser.add_argument("--profile", nargs="?", const=os.path.join(files_path, "trace.json"), metavar="TRACE_FILE",
+                        help="write a Chrome trace of the hot paths (default: trace.json)")
+    parser.add_argument("--log-file", default=os.path.join(files_path, "main.log"))
+    parser.add_argument("--verbose", action="store_true", help="also log progress and debug messages")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s:%(levelname)s:%(name)s: %(message)s', filename=args.log_file)
+    logger = logging.getLogger("daemon")
+    # The packaged exe has no console, sys.stderr is None there
+    if sys.stderr is not None and sys.stderr.isatty():
+        logging.getLogger().addHandler(logging.StreamHandler())
+
+    logger.info(f"Running headless, app is packaged {packaged}")
+    if args.profile:
+        tracing.start(args.profile)
+        logger.info(f"Tracing to {args.profile}")
+
+    settings, has_changed = load_settings(args.settings, logger)
+    if has_changed:
+        save_settings(args.settings, settings)
+
+    stop_event = threading.Event()
+
+    def stop(signal_number, frame):
+        logger.info(f"Got signal {signal_number}, stopping")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    if hasattr(signal, "SIGBREAK"):
+        signal.signal(signal.SIGBREAK, stop)
+
+    # Journal, log offsets and the library index are kept next to the settings
+    service = RecorderService(settings, os.path.dirname(os.path.abspath(args.settings)),
+                              lambda message: log_status(logger, message), logger)
+    exit_code = 0
+    try:
+        service.start()
+        logger.info(f"Watching logs {(time.perf_counter() - started_at) * 1000:.0f}ms after start")
+        service.start_metrics()
+
+        # Wait with a timeout, signals are only handled in between on Windows
+        while not stop_event.wait(1):
+            if not service.listener_thread.is_alive():
+                logger.error("Listener stopped, check the settings and main.log")
+                exit_code = 1
+                break
+    finally:
+        service.close()
+        tracing.stop()
+        logger.info("Exited.")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+"""Local stand-in for the OBS WebSocket (v5) server
+
+Implements the requests and events the recorder uses (StartRecord, StopRecord, SaveReplayBuffer,
+GetLastReplayBufferReplay, RecordStateChanged, ReplayBufferSaved) and writes small dummy video files.
+Response latency, request failures and disconnects can be configured to test the recorder without OBS, e.g.:
+
+    python fake_obs.py --port 4455 --password secret --latency 0.2 --failure-rate 0.1
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import secrets
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+
+websocket_guid = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Event subscription bit for output events (RecordStateChanged, ReplayBufferSaved)
+outputs_subscription = 1 << 6
+
+
+class WebSocketConnection:
+    """Just enough of RFC 6455 (text frames, ping/pong, close) for the obs-websocket protocol"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+        self.send_lock = threading.Lock()
+
+    def handshake(self):
+        request_line = self.reader.readline()
+        if not request_line:
+            return False
+
+        headers = {}
+        while True:
+            line = self.reader.readline().decode("latin1").strip()
+            if not line:
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        key = headers.get("sec-websocket-key")
+        if key is None:
+            self.sock.sendall(b"HTTP/1.1 400 Bad Request\r\n\r\n")
+            return False
+
+        accept = base64.b64encode(hashlib.sha1((key + websocket_guid).encode()).digest()).decode()
+        self.sock.sendall((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode())
+        return True
+
+    def read_exactly(self, length):
+        data = self.reader.read(length)
+        if len(data) < length:
+            raise ConnectionError("Connection closed")
+        return data
+
+    def receive(self):
+        """Receive the next text message, returns None once the connection is closed"""
+        message = b""
+        while True:
+            first, second = self.read_exactly(2)
+            opcode = first & 0x0f
+            length = second & 0x7f
+            if length == 126:
+                length, = struct.unpack("!H", self.read_exactly(2))
+            elif length == 127:
+                length, = struct.unpack("!Q", self.read_exactly(8))
+            mask = self.read_exactly(4) if second & 0x80 else None
+            payload = self.read_exactly(length)
+            if mask is not None:
+                payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+
+            if opcode == 0x8:
+                self.send_frame(0x8, payload[:2])
+                return None
+            if opcode == 0x9:
+                self.send_frame(0xa, payload)
+                continue
+            if opcode == 0xa:
+                continue
+
+            message += payload
+            if first & 0x80:
+                return message.decode("utf8")
+
+    def send_frame(self, opcode, payload):
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 1 << 16:
+            header += bytes([126]) + struct.pack("!H", len(payload))
+        else:
+            header += bytes([127]) + struct.pack("!Q", len(payload))
+        with self.send_lock:
+            self.sock.sendall(header + payload)
+
+    def send(self, message):
+        self.send_frame(0x1, json.dumps(message).encode("utf8"))
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class FakeObsHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.obs.handle_connection(WebSocketConnection(self.request))
+
+
+class FakeObsTCPServer(socketserver.ThreadingTCPServer):
+    # Set on a subclass, the class attribute of ThreadingTCPServer is shared with every other server in the process
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class FakeObsServer:
+    """Fake OBS with a websocket server in a background thread
+
+    latency: seconds every request response is delayed
+    failure_rate: probability (0-1) a request answers with a failure status
+    disconnect_after: drop every connection after this many requests (None to never disconnect)
+    """
+
+    def __init__(self, host="localhost", port=4455, password="", output_dir=None,
+                 latency=0.0, failure_rate=0.0, disconnect_after=None):
+        self.password = password
+        self.output_dir = output_dir or tempfile.mkdtemp(prefix="fake_obs_")
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.disconnect_after = disconnect_after
+
+        self.lock = threading.Lock()
+        self.connections = []
+        self.recording_path = None
+        self.replay_path = None
+        self.file_counter = 0
+        self.request_counts = {}
+        self.request_log = []
+
+        self.server = FakeObsTCPServer((host, port), FakeObsHandler, bind_and_activate=True)
+        self.server.obs = self
+        self.host, self.port = self.server.server_address[:2]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.disconnect_all()
+
+    def disconnect_all(self):
+        """Simulate an OBS crash by dropping all client connections"""
+        with self.lock:
+            connections = [connection for connection, _ in self.connections]
+            self.connections = []
+        for connection in connections:
+            connection.close()
+
+    @property
+    def recording(self):
+        return self.recording_path is not None
+
+    def handle_connection(self, connection):
+        if not connection.handshake():
+            connection.close()
+            return
+
+        hello = {"obsWebSocketVersion": "5.0.0", "rpcVersion": 1}
+        challenge = salt = None
+        if self.password:
+            challenge = base64.b64encode(secrets.token_bytes(32)).decode()
+            salt = base64.b64encode(secrets.token_bytes(32)).decode()
+            hello["authentication"] = {"challenge": challenge, "salt": salt}
+        connection.send({"op": 0, "d": hello})
+
+        requests = 0
+        try:
+            while True:
+                message = connection.receive()
+                if message is None:
+                    break
+                message = json.loads(message)
+
+                if message["op"] == 1:
+                    if self.password and message["d"].get("authentication") != self.expected_auth(challenge, salt):
+                        connection.close()
+                        return
+                    with self.lock:
+                        self.connections.append((connection, message["d"].get("eventSubscriptions", 0)))
+                    connection.send({"op": 2, "d": {"negotiatedRpcVersion": 1}})
+
+                elif message["op"] == 6:
+                    requests += 1
+                    if self.disconnect_after is not None and requests > self.disconnect_after:
+                        break
+                    connection.send({"op": 7, "d": self.handle_request(message["d"])})
+
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                self.connections = [(other, subs) for other, subs in self.connections if other is not connection]
+            connection.close()
+
+    def expected_auth(self, challenge, salt):
+        secret = base64.b64encode(hashlib.sha256((self.password + salt).encode()).digest())
+        return base64.b64encode(hashlib.sha256(secret + challenge.encode()).digest()).decode()
+
+    def emit(self, event_type, event_data):
+        with self.lock:
+            connections = [connection for connection, subs in self.connections if subs & outputs_subscription]
+        for connection in connections:
+            try:
+                connection.send({"op": 5, "d": {
+                    "eventType": event_type,
+                    "eventIntent": outputs_subscription,
+                    "eventData": event_data
+                }})
+            except OSError:
+                pass
+
+    def new_file(self, kind):
+        with self.lock:
+            self.file_counter += 1
+            file_path = os.path.join(self.output_dir, f"{kind}_{self.file_counter}.mkv").replace("\\", "/")
+        with open(file_path, 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+        return file_path
+
+    def handle_request(self, request):
+        request_type = request["requestType"]
+        received = time.monotonic()
+        with self.lock:
+            self.request_counts[request_type] = self.request_counts.get(request_type, 0) + 1
+            self.request_log.append((received, request_type))
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        response = {"requestType": request_type, "requestId": request.get("requestId")}
+        if random.random() < self.failure_rate:
+            response["requestStatus"] = {"result": False, "code": 702, "comment": "Simulated failure"}
+            return response
+
+        code = 100
+        comment = None
+        data = None
+
+        if request_type == "StartRecord":
+            if self.recording:
+                code, comment = 500, "Output is already running"
+            else:
+                self.recording_path = self.new_file("recording")
+                self.emit("RecordStateChanged", {
+                    "outputActive": True, "outputState": "OBS_WEBSOCKET_OUTPUT_STARTED",
+                    "outputPath": self.recording_path
+                })
+        elif request_type == "StopRecord":
+            if not self.recording:
+                code, comment = 501, "Output is not running"
+            else:
+                data = {"outputPath": self.recording_path}
+                self.emit("RecordStateChanged", {
+                    "outputActive": False, "outputState": "OBS_WEBSOCKET_OUTPUT_STOPPED",
+                    "outputPath": self.recording_path
+                })
+                self.recording_path = None
+        elif request_type == "SaveReplayBuffer":
+            self.replay_path = self.new_file("replay")
+            self.emit("ReplayBufferSaved", {"savedReplayPath": self.replay_path})
+        elif request_type == "GetLastReplayBufferReplay":
+            if self.replay_path is None:
+                code, comment = 600, "No replay was saved yet"
+            else:
+                data = {"savedReplayPath": self.replay_path}
+        elif request_type == "GetRecordStatus":
+            data = {"outputActive": self.recording, "outputPaused": False, "outputTimecode": "00:00:00.000",
+                    "outputDuration": 0, "outputBytes": 0}
+        elif request_type == "GetVersion":
+            data = {"obsVersion": "30.0.0", "obsWebSocketVersion": "5.0.0", "rpcVersion": 1,
+                    "availableRequests": ["StartRecord", "StopRecord", "SaveReplayBuffer",
+                                          "GetLastReplayBufferReplay", "GetRecordStatus", "GetVersion"]}
+        else:
+            code, comment = 204, "Unknown request type"
+
+        response["requestStatus"] = {"result": code == 100, "code": code}
+        if comment is not None:
+            response["requestStatus"]["comment"] = comment
+        if data is not None:
+            response["responseData"] = data
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake OBS WebSocket server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=4455)
+    parser.add_argument("--password", default="")
+    parser.add_argument("--output-dir", help="where dummy videos are written (default: a temp directory)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every response is delayed")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability a request fails")
+    parser.add_argument("--disconnect-after", type=int, help="drop connections after this many requests")
+    args = parser.parse_args()
+
+    server = FakeObsServer(
+        host=args.host,
+        port=args.port,
+        password=args.password,
+        output_dir=args.output_dir,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        disconnect_after=args.disconnect_after
+    ).start()
+    print(f"Fake OBS listening on ws://{server.host}:{server.port}, writing videos to {server.output_dir}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import time
+
+
+class FfmpegProgress:
+    """State of a running ffmpeg job, parsed from the key=value blocks ffmpeg writes with -progress"""
+
+    def __init__(self, name, duration=None):
+        self.name = name
+        # Expected length of the output in seconds, needed for the ETA
+        self.duration = duration
+        self.start = time.perf_counter()
+        self.end = None
+        self.values = {}
+
+        self.out_time = 0.0
+        self.total_size = 0
+        self.speed = None
+        self.finished = False
+
+    def feed(self, line):
+        """Parse one line of progress output, return true once a block is complete"""
+        key, separator, value = line.strip().partition("=")
+        if not separator:
+            return False
+        self.values[key] = value.strip()
+        if key != "progress":
+            return False
+
+        self.total_size = self.parse_int("total_size", self.total_size)
+        out_time_us = self.parse_int("out_time_us", None)
+        if out_time_us is not None:
+            self.out_time = max(0.0, out_time_us / 1_000_000)
+        speed = self.values.get("speed", "N/A").rstrip("x")
+        self.speed = float(speed) if speed not in ("N/A", "") else None
+
+        if value.strip() == "end":
+            self.finish()
+        return True
+
+    def parse_int(self, key, default):
+        try:
+            return int(self.values[key])
+        except (KeyError, ValueError):
+            return default
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+        self.finished = True
+
+    @property
+    def wall_time(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    @property
+    def bytes_per_second(self):
+        wall_time = self.wall_time
+        return self.total_size / wall_time if wall_time > 0 else 0.0
+
+    @property
+    def fraction(self):
+        if not self.duration:
+            return None
+        return min(1.0, self.out_time / self.duration)
+
+    @property
+    def eta(self):
+        """Seconds until ffmpeg is done, None while unknown"""
+        if self.finished:
+            return 0.0
+        if not self.duration or self.out_time <= 0:
+            return None
+        rate = self.out_time / self.wall_time
+        return max(0.0, (self.duration - self.out_time) / rate)
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "duration": self.duration,
+            "out_time": self.out_time,
+            "total_size": self.total_size,
+            "wall_time": self.wall_time,
+            "bytes_per_second": self.bytes_per_second,
+            "speed": self.speed,
+            "eta": self.eta,
+            "finished": self.finished,
+        }
+
+    def __str__(self):
+        text = f"{self.name}: {self.bytes_per_second / 1024 / 1024:.1f}MB/s"
+        if self.speed is not None:
+            text += f", {self.speed:.1f}x"
+        if self.fraction is not None:
+            text += f", {self.fraction * 100:.0f}%"
+        if self.eta is not None:
+            text += f", ETA {self.eta:.0f}s"
+        return text
@@ -0,0 +1,125 @@
+import contextlib
+import errno
+import os
+import shutil
+import sys
+
+
+def atomic_write(path, data):
+    """Replace the contents of path with the text data, going through a temporary file so a crash can't leave a
+    half written file behind and readers always see a complete one"""
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def same_volume(source, destination):
+    """Whether a rename from source to destination can work, i.e. both are on the same file system"""
+    destination_directory = os.path.dirname(os.path.abspath(destination))
+    return os.stat(source).st_dev == os.stat(destination_directory).st_dev
+
+
+def move(source, destination, progress_callback=None, chunk_size=64 * 1024 * 1024):
+    """Move a file, copying it if destination is on another drive
+
+    A cross drive copy goes to destination + ".part" first and only replaces destination and deletes the source
+    once it was verified. progress_callback(copied, total) is called after every chunk and may block to pause the
+    copy. Returns true if the file had to be copied.
+    """
+    if same_volume(source, destination):
+        try:
+            os.rename(source, destination)
+            return False
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+    temp_path = destination + ".part"
+    try:
+        copy(source, temp_path, progress_callback, chunk_size)
+        verify(source, temp_path)
+        # Keep the modification time, it tells when OBS finished the file
+        shutil.copystat(source, temp_path)
+        os.replace(temp_path, destination)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
+    os.remove(source)
+    return True
+
+
+def copy(source, destination, progress_callback=None, chunk_size=64 * 1024 * 1024):
+    """Copy a file in chunks, in the kernel where the platform allows it"""
+    with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+        total = os.fstat(source_file.fileno()).st_size
+        copied = 0
+        copy_functions = kernel_copy_functions()
+        buffer = None
+
+        while copied < total:
+            length = min(chunk_size, total - copied)
+            written = 0
+            if copy_functions:
+                try:
+                    written = copy_functions[0](source_file.fileno(), destination_file.fileno(), copied, length)
+                except OSError as e:
+                    # Not supported for these file systems (e.g. network drives), try the next way
+                    if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                        raise
+                    copy_functions.pop(0)
+                    continue
+            else:
+                if buffer is None:
+                    buffer = memoryview(bytearray(min(chunk_size, 8 * 1024 * 1024)))
+                source_file.seek(copied)
+                destination_file.seek(copied)
+                read = source_file.readinto(buffer[:min(length, len(buffer))])
+                destination_file.write(buffer[:read])
+                written = read
+
+            if written == 0:
+                raise OSError(f"{source} shrank while copying it")
+            copied += written
+            if progress_callback is not None:
+                progress_callback(copied, total)
+
+        destination_file.flush()
+        os.fsync(destination_file.fileno())
+
+
+def kernel_copy_functions():
+    """copy(source_fd, destination_fd, offset, length) functions copying in the kernel, best first
+
+    Empty on Windows, where chunks are copied through a reused buffer instead.
+    """
+    functions = []
+    if hasattr(os, "copy_file_range"):
+        def copy_file_range(source_fd, destination_fd, offset, length):
+            return os.copy_file_range(source_fd, destination_fd, length, offset, offset)
+        functions.append(copy_file_range)
+
+    # Only linux can sendfile into a regular file
+    if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+        def sendfile(source_fd, destination_fd, offset, length):
+            os.lseek(destination_fd, offset, os.SEEK_SET)
+            return os.sendfile(destination_fd, source_fd, offset, length)
+        functions.append(sendfile)
+
+    return functions
+
+
+def verify(source, copied, sample_size=1024 * 1024):
+    """Compare size and samples from the start, middle and end of both files without reading them completely"""
+    size = os.path.getsize(source)
+    if os.path.getsize(copied) != size:
+        raise OSError(f"Copy of {source} has the wrong size")
+
+    offsets = {0, max(0, size // 2 - sample_size // 2), max(0, size - sample_size)}
+    with open(source, 'rb') as source_file, open(copied, 'rb') as copied_file:
+        for offset in sorted(offsets):
+            source_file.seek(offset)
+            copied_file.seek(offset)
+            if source_file.read(sample_size) != copied_file.read(sample_size):
+                raise OSError(f"Copy of {source} differs from the original")
@@ -0,0 +1,59 @@
+import json
+import os
+import threading
+
+import file_mover
+
+
+class JobJournal:
+    """Append-only journal of the processing state of every fight, so unfinished work survives a crash or restart
+
+    Every state change appends one JSON line {"name": ..., "state": ..., "data": {...}}, the last line of a name
+    wins. A line cut off by a crash is ignored. Finished entries are dropped when the journal is compacted on load.
+    """
+
+    finished_states = ("done", "failed")
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry["name"]] = entry
+        except FileNotFoundError:
+            pass
+
+        for name in [name for name, entry in self.entries.items() if entry["state"] in self.finished_states]:
+            del self.entries[name]
+        self.compact()
+
+    def compact(self):
+        """Rewrite the journal with only the current state of unfinished entries"""
+        with self.lock:
+            file_mover.atomic_write(self.path, "".join(json.dumps(entry) + "\n" for entry in self.entries.values()))
+
+    def record(self, name, state, data):
+        entry = {"name": name, "state": state, "data": data}
+        with self.lock:
+            if state in self.finished_states:
+                self.entries.pop(name, None)
+            else:
+                self.entries[name] = entry
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def unfinished(self):
+        """Entries that still have work left, in the order they were added"""
+        with self.lock:
+            return list(self.entries.values())
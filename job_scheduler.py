@@ -0,0 +1,205 @@
+import queue
+import threading
+import time
+from enum import Enum
+
+import tracing
+
+
+class JobState(Enum):
+    WAITING = 1
+    QUEUED = 2
+    RUNNING = 3
+    DONE = 4
+    FAILED = 5
+    CANCELLED = 6
+
+
+class ActivityGate:
+    """Keeps heavy background work away while the player is recording or was in combat recently"""
+
+    def __init__(self, quiet_period=60):
+        self.quiet_period = quiet_period
+        self.condition = threading.Condition()
+        self.busy_until = 0
+        self.recording = False
+
+    def mark_activity(self):
+        with self.condition:
+            self.busy_until = time.monotonic() + self.quiet_period
+
+    def set_recording(self, recording):
+        with self.condition:
+            self.recording = recording
+            if not recording:
+                self.busy_until = max(self.busy_until, time.monotonic() + self.quiet_period)
+            self.condition.notify_all()
+
+    def release(self):
+        """Stop holding back work, e.g. once no more fights will be recorded"""
+        with self.condition:
+            self.recording = False
+            self.busy_until = 0
+            self.condition.notify_all()
+
+    def is_open(self):
+        return not self.recording and time.monotonic() >= self.busy_until
+
+    def wait_open(self, stop_event=None):
+        """Block until heavy work may run again"""
+        with self.condition:
+            while not self.is_open() and not (stop_event is not None and stop_event.is_set()):
+                timeout = None if self.recording else self.busy_until - time.monotonic()
+                self.condition.wait(timeout)
+
+
+class Job:
+    """A unit of work for the JobScheduler, dependents only run once it finished successfully"""
+
+    def __init__(self, name, function, args, heavy=False):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.heavy = heavy
+        self.state = JobState.WAITING
+        self.error = None
+        self.dependents = []
+        self.done = threading.Event()
+
+    def __repr__(self):
+        return f"Job({self.name!r}, {self.state.name})"
+
+
+class JobScheduler:
+    """Run jobs on a bounded pool of worker threads
+
+    Jobs can depend on another job (e.g. rename -> concatenate -> delete of one fight), a dependent is only queued
+    once the job it depends on is done and is cancelled if that one failed.
+    Heavy jobs are held back while the activity gate is closed and queued again once it opens.
+    """
+
+    def __init__(self, workers, logger, name="processing", gate=None):
+        self.logger = logger
+        self.gate = gate or ActivityGate(quiet_period=0)
+        self.queue = queue.Queue()
+        # Notified whenever no jobs are pending anymore or heavy jobs got deferred
+        self.lock = threading.Condition()
+        self.pending = 0
+        self.deferred = []
+        self.closed = False
+        self.stop_event = threading.Event()
+
+        self.release_thread = threading.Thread(target=self.release_deferred, name=f"{name}-release", daemon=True)
+        self.release_thread.start()
+
+        self.workers = [
+            threading.Thread(target=self.work, name=f"{name}-{i}")
+            for i in range(max(1, workers))
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    @property
+    def queue_depth(self):
+        """Number of jobs that are queued, waiting on another job or running"""
+        return self.pending
+
+    def submit(self, name, function, *args, after=None, heavy=False):
+        """Schedule function(*args), optionally only after another job finished"""
+        job = Job(name, function, args, heavy)
+        with self.lock:
+            self.pending += 1
+            if after is not None and after.state in (JobState.FAILED, JobState.CANCELLED):
+                self.cancel(job)
+                return job
+            if after is not None and after.state is not JobState.DONE:
+                after.dependents.append(job)
+                return job
+            job.state = JobState.QUEUED
+        self.queue.put(job)
+        self.logger.info(f"Queued {job.name} (queue depth {self.queue_depth})")
+        return job
+
+    def cancel(self, job):
+        """Cancel a job and everything depending on it, needs the lock"""
+        job.state = JobState.CANCELLED
+        job.done.set()
+        self.pending -= 1
+        for dependent in job.dependents:
+            self.cancel(dependent)
+        if self.pending == 0:
+            self.lock.notify_all()
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+
+            # A fight is going on -> put heavy work aside until it is over
+            if job.heavy and not self.gate.is_open():
+                with self.lock:
+                    self.deferred.append(job)
+                    self.lock.notify_all()
+                self.logger.info(f"Deferred {job.name} until combat is over")
+                continue
+
+            job.state = JobState.RUNNING
+            try:
+                with tracing.span(job.name, "job"):
+                    job.function(*job.args)
+            except Exception as e:
+                job.error = e
+                self.logger.error(f"{job.name} failed", exc_info=True)
+
+            with self.lock:
+                self.pending -= 1
+                ready = []
+                if job.error is None:
+                    job.state = JobState.DONE
+                    for dependent in job.dependents:
+                        dependent.state = JobState.QUEUED
+                        ready.append(dependent)
+                else:
+                    job.state = JobState.FAILED
+                    for dependent in job.dependents:
+                        self.cancel(dependent)
+                if self.pending == 0:
+                    self.lock.notify_all()
+            job.done.set()
+
+            for dependent in ready:
+                self.queue.put(dependent)
+
+    def release_deferred(self):
+        """Background thread queueing deferred jobs again once the gate opens"""
+        while not self.stop_event.is_set():
+            with self.lock:
+                while not self.deferred and not self.stop_event.is_set():
+                    self.lock.wait()
+
+            self.gate.wait_open(self.stop_event)
+
+            with self.lock:
+                jobs, self.deferred = self.deferred, []
+            for job in jobs:
+                self.queue.put(job)
+
+    def close(self):
+        """Let the workers finish all scheduled jobs and exit afterwards"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        threading.Thread(target=self.shutdown).start()
+
+    def shutdown(self):
+        # Wait for chains to be fully queued before telling the workers to stop
+        with self.lock:
+            while self.pending > 0:
+                self.lock.wait()
+        for _ in self.workers:
+            self.queue.put(None)
+        with self.lock:
+            self.stop_event.set()
+            self.lock.notify_all()
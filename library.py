@@ -0,0 +1,285 @@
+import contextlib
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+
+import file_mover
+import low_priority
+from job_scheduler import JobScheduler
+
+# Only files written by the pipeline are managed, anything else in the output directory is left alone
+fight_file_regex = re.compile(r"^(\d{8}-\d{6})_(replay|recording|concatenated)\.\w+$")
+
+
+class OutputLibrary:
+    """Keeps the output directory within a size quota and retention time
+
+    Sizes and ages are kept in an index that is updated for files the pipeline reports and, every check_interval
+    and only if the directory itself changed, from one scandir of it. Old fights can optionally be re-encoded to a smaller codec by
+    low priority ffmpeg processes that wait for combat to be over.
+
+    max_bytes: delete the oldest fights while the managed files are larger (0 for no quota)
+    max_age: delete fights older than this many seconds (0 to keep them forever)
+    reencode_age: re-encode files older than this many seconds (0 to never re-encode)
+    tools: ToolProvisioner providing ffmpeg instead of the ffmpeg argument
+    in_use: returns the names of fights the pipeline is still working on, those are never touched
+    """
+
+    def __init__(self, directory, index_path, logger, gate, max_bytes=0, max_age=0, reencode_age=0,
+                 codec="libx265", crf=28, ffmpeg="ffmpeg", tools=None, in_use=None, check_interval=600, workers=1):
+        self.directory = directory
+        self.index_path = index_path
+        self.logger = logger
+        self.gate = gate
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.reencode_age = reencode_age
+        self.codec = codec
+        self.crf = crf
+        self.ffmpeg = ffmpeg
+        self.tools = tools
+        self.in_use = in_use or set
+        self.check_interval = check_interval
+
+        self.lock = threading.Lock()
+        # file name -> {"size", "mtime", "reencoded"}
+        self.files = {}
+        self.directory_mtime = None
+        self.reencoding = set()
+        self.processes = set()
+        self.load_index()
+
+        self.scheduler = JobScheduler(workers, logger, name="library", gate=gate)
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.maintain, daemon=True)
+
+    @property
+    def total_size(self):
+        with self.lock:
+            return sum(entry["size"] for entry in self.files.values())
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def close(self):
+        """Stop checking, a running re-encode is stopped and queued ones are dropped, they are picked up again later"""
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        with self.lock:
+            processes = list(self.processes)
+        for process in processes:
+            process.kill()
+        self.scheduler.close()
+        self.save_index()
+
+    def load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+
+        if index.get("directory") != self.directory:
+            return
+        self.files = index["files"]
+        self.directory_mtime = index["directory_mtime"]
+
+    def save_index(self):
+        with self.lock:
+            index = {
+                "directory": self.directory,
+                "directory_mtime": self.directory_mtime,
+                "files": dict(self.files)
+            }
+        file_mover.atomic_write(self.index_path, json.dumps(index))
+
+    def add(self, file_path):
+        """Called by the pipeline for every file it finished writing to the output directory"""
+        file_name = os.path.basename(file_path)
+        if fight_file_regex.match(file_name) is None:
+            return
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            self.remove(file_path)
+            return
+        with self.lock:
+            entry = self.files.setdefault(file_name, {"reencoded": False})
+            entry["size"] = stat.st_size
+            entry["mtime"] = stat.st_mtime
+        self.wake_event.set()
+
+    def remove(self, file_path):
+        with self.lock:
+            self.files.pop(os.path.basename(file_path), None)
+
+    def refresh(self):
+        """Bring the index up to date, only lists the directory if it changed since the last time"""
+        try:
+            directory_mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if directory_mtime == self.directory_mtime:
+            return
+
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if fight_file_regex.match(entry.name) is None or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                with self.lock:
+                    known = self.files.get(entry.name)
+                reencoded = known is not None and known["reencoded"]
+                files[entry.name] = {"size": stat.st_size, "mtime": stat.st_mtime, "reencoded": reencoded}
+
+        with self.lock:
+            self.files = files
+            self.directory_mtime = directory_mtime
+
+    def fights(self):
+        """(newest mtime, name, file names) of every fight in the index, oldest first"""
+        fights = {}
+        with self.lock:
+            for file_name, entry in self.files.items():
+                name = fight_file_regex.match(file_name).group(1)
+                mtime, file_names = fights.get(name, (0, []))
+                fights[name] = (max(mtime, entry["mtime"]), file_names + [file_name])
+        return sorted((mtime, name, file_names) for name, (mtime, file_names) in fights.items())
+
+    def enforce(self):
+        """Delete fights that are too old or don't fit into the quota anymore, oldest first"""
+        in_use = self.in_use()
+        total_size = self.total_size
+        now = time.time()
+
+        for mtime, name, file_names in self.fights():
+            too_old = self.max_age and now - mtime > self.max_age
+            too_big = self.max_bytes and total_size > self.max_bytes
+            if not too_old and not too_big:
+                break
+            if name in in_use or any(file_name in self.reencoding for file_name in file_names):
+                continue
+
+            self.logger.info(f"Deleting fight {name} from the library ({'age' if too_old else 'quota'})")
+            for file_name in file_names:
+                with self.lock:
+                    total_size -= self.files.pop(file_name, {"size": 0})["size"]
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.directory, file_name))
+
+    def schedule_reencodes(self):
+        if not self.reencode_age:
+            return
+        # Checked again later, a failing re-encode would not be tried a second time
+        if self.tools is not None and not self.tools.ready:
+            return
+
+        in_use = self.in_use()
+        cutoff = time.time() - self.reencode_age
+        with self.lock:
+            candidates = [
+                file_name for file_name, entry in self.files.items()
+                if not entry["reencoded"] and entry["mtime"] < cutoff and file_name not in self.reencoding
+                and fight_file_regex.match(file_name).group(1) not in in_use
+            ]
+            self.reencoding.update(candidates)
+
+        for file_name in candidates:
+            self.scheduler.submit(f"re-encode {file_name}", self.reencode, file_name, heavy=True)
+
+    def reencode(self, file_name):
+        """Re-encode a file in place with a smaller codec, the original stays until the new one is complete"""
+        file_path = os.path.join(self.directory, file_name)
+        root, extension = os.path.splitext(file_path)
+        temp_path = f"{root}.reencode{extension}"
+
+        try:
+            # Closing the library drops queued re-encodes, the next check schedules them again
+            if self.stop_event.is_set():
+                return
+            self.run_reencode(file_path, temp_path)
+
+            old_size = os.path.getsize(file_path)
+            new_size = os.path.getsize(temp_path)
+            if new_size < old_size:
+                # Keep the modification time so the age of the fight does not change
+                os.utime(temp_path, (os.path.getatime(file_path), os.path.getmtime(file_path)))
+                os.replace(temp_path, file_path)
+                self.logger.info(f"Re-encoded {file_name} from {old_size / 1024 / 1024:.0f}MB "
+                                 f"to {new_size / 1024 / 1024:.0f}MB")
+            else:
+                self.logger.info(f"Re-encoding did not make {file_name} smaller, keeping the original")
+            self.mark_reencoded(file_path)
+        except Exception:
+            if not self.stop_event.is_set():
+                # Don't try the same broken file over and over again
+                self.mark_reencoded(file_path)
+            raise
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_path)
+            with self.lock:
+                self.reencoding.discard(file_name)
+
+    def run_reencode(self, file_path, temp_path):
+        ffmpeg = self.tools.ffmpeg if self.tools is not None else self.ffmpeg
+        process = low_priority.popen(
+            [
+                ffmpeg, "-y", "-loglevel", "error",
+                "-i", file_path,
+                "-map", "0",
+                "-c:v", self.codec, "-crf", str(self.crf),
+                "-c:a", "copy",
+                temp_path
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        with self.lock:
+            self.processes.add(process)
+        try:
+            # With -loglevel error there is too little output to fill the pipe, it can be read at the end
+            low_priority.wait(process, self.gate, self.logger)
+            stderr = process.stderr.read()
+        finally:
+            process.stderr.close()
+            with self.lock:
+                self.processes.discard(process)
+
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed with return code {process.returncode}: {stderr.strip()}")
+
+    def mark_reencoded(self, file_path):
+        self.add(file_path)
+        with self.lock:
+            entry = self.files.get(os.path.basename(file_path))
+            if entry is not None:
+                entry["reencoded"] = True
+
+    def check(self, rescan=True):
+        # The pipeline changes the directory with every fight, but add() and remove() already keep the index current
+        if rescan:
+            self.refresh()
+        self.enforce()
+        self.schedule_reencodes()
+        self.save_index()
+
+    def maintain(self):
+        """Background thread checking the library every check_interval seconds and whenever files were added"""
+        woken = False
+        while not self.stop_event.is_set():
+            try:
+                self.check(rescan=not woken)
+            except Exception:
+                self.logger.error("Checking the output library failed", exc_info=True)
+            woken = self.wake_event.wait(self.check_interval)
+            self.wake_event.clear()
@@ -1,6 +1,9 @@
+import os
+import threading
 import time
 from enum import Enum
 
+import tracing
 from logreader import LogReader
 from recorder import TimeoutRecording
 
@@ -12,45 +15,155 @@ class RecordingStatusCallback(Enum):
     RECORDING_ERROR = 4
 
 
-def run(settings, status_callback, stop_event, video_processing_pipeline, logger):
+class PollSchedule:
+    """Decides how long the listener may sleep, on the monotonic clock
+
+    Logs are polled every combat_interval seconds while recording or within combat_window seconds of the last
+    combat line and every idle_interval seconds otherwise, a running recording wakes the listener at its timeout.
+    """
+
+    def __init__(self, idle_interval=2.0, combat_interval=0.25, combat_window=10.0):
+        self.idle_interval = idle_interval
+        self.combat_interval = combat_interval
+        self.combat_window = combat_window
+        self.last_activity = None
+
+    def mark_activity(self):
+        self.last_activity = time.monotonic()
+
+    def in_combat(self, recorder):
+        if recorder.recording:
+            return True
+        return self.last_activity is not None and time.monotonic() - self.last_activity < self.combat_window
+
+    def timeout(self, recorder):
+        """Seconds until the listener has to do something again"""
+        timeout = self.combat_interval if self.in_combat(recorder) else self.idle_interval
+        time_left = recorder.time_left()
+        if time_left is not None:
+            timeout = min(timeout, time_left)
+        return timeout
+
+
+class ListenerStopEvent(threading.Event):
+    """Stop event of the listener, setting it also wakes a listener that is waiting for log changes"""
+
+    def __init__(self):
+        super().__init__()
+        self.wake_hooks = []
+        self.hooks_lock = threading.Lock()
+
+    def add_wake_hook(self, hook):
+        with self.hooks_lock:
+            self.wake_hooks.append(hook)
+        # Set before the hook was there, nobody would wake it
+        if self.is_set():
+            hook()
+
+    def remove_wake_hook(self, hook):
+        with self.hooks_lock:
+            if hook in self.wake_hooks:
+                self.wake_hooks.remove(hook)
+
+    def set(self):
+        super().set()
+        with self.hooks_lock:
+            hooks = list(self.wake_hooks)
+        for hook in hooks:
+            hook()
+
+
+def run(settings, status_callback, stop_event, video_processing_pipeline, logger, files_path, obs_connection):
     try:
-        log_checker = LogReader(
-            settings["LOG_DIR"]
+        # Everything that can be wrong in the settings first, the reader and recorder hold resources
+        trigger_threshold = float(settings.get("TRIGGER_THRESHOLD", 1))
+        timeout = float(settings["TIMEOUT"])
+        schedule = PollSchedule(
+            idle_interval=float(settings.get("POLL_INTERVAL_IDLE", 2)),
+            combat_interval=float(settings.get("POLL_INTERVAL_COMBAT", 0.25))
         )
 
+        log_checker = LogReader(
+            settings["LOG_DIR"],
+            idle_window=int(settings.get("LOG_IDLE_WINDOW", 24 * 60 * 60)),
+            checkpoint_path=os.path.join(files_path, "log_offsets.json"),
+            trigger_rules=settings.get("TRIGGER_RULES"),
+            logger=logger
+        )
         timeout_recorder = TimeoutRecording(
-            host=settings['OBS_HOST'],
-            port=int(settings['OBS_PORT']),
-            password=settings['OBS_PASSWORD'],
+            connection=obs_connection,
             logger=logger,
-            timeout=int(settings["TIMEOUT"])
+            timeout=timeout
         )
 
     except Exception as e:
         status_callback((RecordingStatusCallback.RECORDING_ERROR, e))
         return
-    else:
+
+    # Stop right away instead of after the next poll
+    stop_event.add_wake_hook(log_checker.wake)
+
+    def report_ended(obs_connected):
+        """Report the end of a fight, unless the connection is gone, ready would hide that error"""
+        if obs_connection.connected.is_set():
+            status_callback(RecordingStatusCallback.RECORDING_ENDED)
+            return True
+        if obs_connected:
+            status_callback((RecordingStatusCallback.RECORDING_ERROR, obs_connection.last_error))
+        return False
+
+    # Give a fresh connection a moment, afterwards the status follows the connection
+    obs_connected = obs_connection.wait_connected(3)
+    if obs_connected:
         status_callback(RecordingStatusCallback.RECORDING_READY)
+    else:
+        status_callback((RecordingStatusCallback.RECORDING_ERROR, obs_connection.last_error))
 
     try:
+        files_changed = True
         while True:
-            if log_checker.check_files():
-                if timeout_recorder.set_timeout():
-                    status_callback(RecordingStatusCallback.RECORDING_STARTED)
-
-            if timeout_recorder.check_timeout():
-                status_callback(RecordingStatusCallback.RECORDING_ENDED)
-                video_processing_pipeline.process(
-                    timeout_recorder.replay_path,
-                    timeout_recorder.recording_path,
-                    settings["OUTPUT_DIR"],
-                    timeout_recorder.output_name
-                )
+            with tracing.span("listener iteration", "listener", files_changed=files_changed):
+                if obs_connection.connected.is_set() != obs_connected:
+                    obs_connected = not obs_connected
+                    if obs_connected:
+                        status_callback(RecordingStatusCallback.RECORDING_READY)
+                    else:
+                        status_callback((RecordingStatusCallback.RECORDING_ERROR, obs_connection.last_error))
+
+                if files_changed:
+                    # Start once the weights of this poll reach the threshold, afterwards any rule keeps it running
+                    score = 0
+                    for event in log_checker.read_events():
+                        # Any combat keeps heavy post-processing away, even if it does not trigger a recording
+                        video_processing_pipeline.gate.mark_activity()
+                        schedule.mark_activity()
+                        score += event.weight
+                        # Without OBS a start_record would only fail, a running recording is still extended
+                        if timeout_recorder.recording or (score >= trigger_threshold and obs_connected):
+                            if timeout_recorder.set_timeout(event.extension):
+                                video_processing_pipeline.gate.set_recording(True)
+                                status_callback(RecordingStatusCallback.RECORDING_STARTED)
+
+                if timeout_recorder.check_timeout():
+                    video_processing_pipeline.gate.set_recording(False)
+                    obs_connected = report_ended(obs_connected)
+                    video_processing_pipeline.process(timeout_recorder.session, settings["OUTPUT_DIR"])
+                elif timeout_recorder.check_cancelled():
+                    # OBS did not start recording, e.g. because it was recording already
+                    video_processing_pipeline.gate.set_recording(False)
+                    obs_connected = report_ended(obs_connected)
 
             # check for stop
             if stop_event.is_set():
                 break
 
-            time.sleep(1)
+            # Wakes up early as soon as a gamelog is written to or we are asked to stop
+            with tracing.span("wait_for_changes", "listener"):
+                files_changed = log_checker.wait_for_changes(schedule.timeout(timeout_recorder))
     except Exception as e:
         status_callback((RecordingStatusCallback.RECORDING_ERROR, e))
+    finally:
+        stop_event.remove_wake_hook(log_checker.wake)
+        video_processing_pipeline.gate.set_recording(False)
+        log_checker.close()
+        timeout_recorder.close()
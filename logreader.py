@@ -1,85 +1,348 @@
+import json
+import logging
 import os
-import re
 import time
 
+import file_mover
+import metrics
+import tracing
+from combat_events import parse_line, parse_listener
+from trigger_rules import TriggerRules
+from watcher import create_watcher
+
+poll_seconds = metrics.histogram("logreader_poll_seconds", "Duration of one poll of the observed gamelogs")
+bytes_read = metrics.counter("logreader_bytes_read_total", "Bytes read from gamelogs")
+files_observed = metrics.gauge("logreader_files_observed", "Number of gamelogs currently observed")
+events_found = metrics.counter("logreader_events_total", "Combat events that matched a trigger rule")
+
 
 class LogReader:
     """Monitor an eve log directory for log changes and return true if something interesting happends"""
 
-    def __init__(self, directory):
+    # Lines longer than this are dropped instead of being buffered forever
+    max_line_length = 64 * 1024
+
+    def __init__(self, directory, chunk_size=64 * 1024, idle_window=24 * 60 * 60, rescan_interval=60,
+                 checkpoint_path=None, checkpoint_interval=5, checkpoint_max_age=300, trigger_rules=None, logger=None):
         self.directory = directory
+        self.logger = logger or logging.getLogger("logreader")
+        self.chunk_size = chunk_size
+        self.idle_window = idle_window
+        self.rescan_interval = rescan_interval
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        # An older checkpoint is ignored, resuming from it would replay fights that are long over
+        self.checkpoint_max_age = checkpoint_max_age
 
-        self.regex = re.compile(r'\(combat\)|has applied bonuses to')
+        self.rules = TriggerRules(trigger_rules)
+        self.regex = self.rules.regex
 
-        # Figure out current file state
+        # Figure out current file state, offsets are in bytes
         self.observed_files = {}
-        self.file_count = 0
+        self.file_identities = {}
+        self.file_mtimes = {}
+        self.file_handles = {}
+        self.partial_lines = {}
+        self.characters = {}
+
+        # Files dropped for being idle remember where we stopped so they resume instead of replaying,
+        # (inode, offset, time of eviction), forgotten after another idle window
+        self.evicted_files = {}
+
+        self.directory_mtime = None
+        self.next_rescan = 0
+
+        # Resume from the last run if possible so lines written during a restart are not lost
+        self.checkpoint_time = None
+        self.last_checkpoint = time.time()
+        # Only write the checkpoint if an offset or the set of files changed since the last one
+        self.checkpoint_dirty = False
+        self.load_checkpoint()
         self.add_new_files(skip=True)
 
+        # Get notified on file changes where the platform supports it
+        self.watcher = create_watcher(directory)
+
     def add_new_files(self, skip=False):
-        """Add check if there are new files and add them to the observed files
-        (if they are less than 24h old)"""
-        files = os.listdir(self.directory)
+        """Check if there are new or replaced files and add them to the observed files
+        (if they were edited within the idle window)"""
+        now = time.time()
 
-        # Check count of files first to save on cpu load
-        if len(files) == self.file_count:
+        # Only rescan if the directory entries changed (or once in a while to be safe) to save on cpu load
+        directory_mtime = os.stat(self.directory).st_mtime_ns
+        if directory_mtime == self.directory_mtime and now < self.next_rescan:
             return
 
-        self.file_count = len(files)
+        self.directory_mtime = directory_mtime
+        self.next_rescan = now + self.rescan_interval
 
-        for file_name in files:
-            file_path = os.path.join(self.directory, file_name)
+        present_files = set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
 
-            # Only add files that are not already added
-            if file_path in self.observed_files:
-                continue
+                file_path = entry.path
+                present_files.add(file_path)
 
-            # Only index files which were edited in the last 24 hours to save on cpu load
-            if os.path.getmtime(file_path) < time.time() - 24 * 60 * 60:
-                continue
+                if file_path in self.observed_files:
+                    inode = entry.inode()
+                    if self.file_identities[file_path] != inode:
+                        # A new file took the place of the old one -> read it from the start
+                        self.close_handle(file_path)
+                        self.observed_files[file_path] = 0
+                        self.file_identities[file_path] = inode
+                        self.checkpoint_dirty = True
+                    continue
+
+                # Only index files which were edited within the idle window to save on cpu load, the mtime comes
+                # with the directory listing on Windows while the inode costs opening the file
+                stat = entry.stat()
+                if stat.st_mtime < now - self.idle_window:
+                    continue
+                inode = entry.inode()
 
-            if skip:
-                # skip means we should ignore any already existing files ->
-                # we add their end to the observed files in case they still get actively written too
-                self.observed_files[file_path] = os.path.getsize(file_path)
-            else:
-                # We add any file from the start
-                self.observed_files[file_path] = 0
+                evicted = self.evicted_files.pop(file_path, None)
+                if evicted is not None and evicted[0] == inode:
+                    # We already read this file before it went idle -> resume
+                    self.observed_files[file_path] = evicted[1]
+                elif skip and self.checkpoint_time is not None and stat.st_mtime > self.checkpoint_time:
+                    # The file was created after our last checkpoint -> read all of it
+                    self.observed_files[file_path] = 0
+                elif skip:
+                    # skip means we should ignore any already existing files ->
+                    # we add their end to the observed files in case they still get actively written too
+                    self.observed_files[file_path] = stat.st_size
+                else:
+                    # We add any file from the start
+                    self.observed_files[file_path] = 0
 
-    def check_log_content(self, log_content):
-        """Check if there was something interesting in log content"""
+                self.file_identities[file_path] = inode
+                self.file_mtimes[file_path] = stat.st_mtime
+                self.checkpoint_dirty = True
+
+        # Forget about files that no longer exist and, as gamelogs are never deleted, files that have been evicted
+        # for a whole idle window, so the memory and checkpoint don't grow with the log history
+        for file_path in list(self.observed_files.keys()):
+            if file_path not in present_files:
+                self.forget_file(file_path)
+        for file_path, (inode, offset, evicted_at) in list(self.evicted_files.items()):
+            if file_path not in present_files or evicted_at < now - self.idle_window:
+                del self.evicted_files[file_path]
+                self.checkpoint_dirty = True
+
+    def load_checkpoint(self):
+        """Load file offsets saved by a previous reader of the same directory"""
+        if self.checkpoint_path is None:
+            return
 
-        # Early stop on empty log_content to save on CPU load
-        if len(log_content) == 0:
-            return False
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            # Start like without a checkpoint, reading the logs is more important
+            self.logger.warning(f"Could not load the log offsets from {self.checkpoint_path}", exc_info=True)
+            return
+
+        if checkpoint.get("directory") != self.directory:
+            return
+        if time.time() - checkpoint["time"] > self.checkpoint_max_age:
+            return
+
+        # Checkpointed files are treated like evicted ones, add_new_files resumes them if they are unchanged
+        self.checkpoint_time = checkpoint["time"]
+        for file_path, (inode, offset, *evicted_at) in checkpoint["files"].items():
+            self.evicted_files[file_path] = (inode, offset, evicted_at[0] if evicted_at else self.checkpoint_time)
+
+    def save_checkpoint(self):
+        """Persist the current file offsets so a restarted reader can pick up where we stopped"""
+        if self.checkpoint_path is None:
+            return
+
+        files = {file_path: list(evicted) for file_path, evicted in self.evicted_files.items()}
+        for file_path, offset in self.observed_files.items():
+            # Don't count incomplete lines as read, they would be lost otherwise
+            offset -= len(self.partial_lines.get(file_path, b""))
+            files[file_path] = [self.file_identities[file_path], offset]
+
+        checkpoint = {
+            "directory": self.directory,
+            "time": time.time(),
+            "files": files
+        }
+
+        # Tried again after the next interval, e.g. the disk is full or a virus scanner has the file open
+        self.last_checkpoint = time.time()
+        try:
+            file_mover.atomic_write(self.checkpoint_path, json.dumps(checkpoint))
+        except OSError:
+            self.logger.warning(f"Could not save the log offsets to {self.checkpoint_path}", exc_info=True)
+            return
+        self.checkpoint_dirty = False
 
-        return re.search(self.regex, log_content) is not None
+    def save_checkpoint_if_due(self):
+        if self.checkpoint_dirty and time.time() - self.last_checkpoint >= self.checkpoint_interval:
+            self.save_checkpoint()
+
+    def forget_file(self, file_path):
+        self.close_handle(file_path)
+        if self.observed_files.pop(file_path, None) is not None:
+            self.checkpoint_dirty = True
+        self.file_identities.pop(file_path, None)
+        self.file_mtimes.pop(file_path, None)
+
+    def evict_idle_files(self):
+        """Stop observing files that have not been written to within the idle window"""
+        now = time.time()
+        cutoff = now - self.idle_window
+        for file_path, mtime in list(self.file_mtimes.items()):
+            if mtime < cutoff:
+                self.evicted_files[file_path] = (self.file_identities[file_path], self.observed_files[file_path], now)
+                self.forget_file(file_path)
+
+    def get_handle(self, file_path):
+        """Get a persistent binary handle for a log file so we don't reopen it on every poll"""
+        handle = self.file_handles.get(file_path)
+        if handle is None:
+            handle = open(file_path, 'rb')
+            self.file_handles[file_path] = handle
+        return handle
+
+    def close_handle(self, file_path):
+        handle = self.file_handles.pop(file_path, None)
+        if handle is not None:
+            handle.close()
+        self.partial_lines.pop(file_path, None)
+        self.characters.pop(file_path, None)
+
+    def get_character(self, file_path):
+        """Get the character a gamelog belongs to from its header"""
+        if file_path not in self.characters:
+            handle = self.get_handle(file_path)
+            handle.seek(0)
+            self.characters[file_path] = parse_listener(handle.read(1024))
+        return self.characters[file_path]
+
+    def check_log_content(self, data, end):
+        """Find all complete lines in data[:end] with something interesting in them and return them decoded"""
+        lines = []
+        line_end = 0
+        for match in self.regex.finditer(data, 0, end):
+            # Skip further matches on a line we already have
+            if match.start() < line_end:
+                continue
+            line_start = data.rfind(b"\n", 0, match.start()) + 1
+            line_end = data.find(b"\n", match.end(), end)
+            lines.append(data[line_start:line_end].rstrip(b"\r").decode("utf8", errors="replace"))
+        return lines
 
     def read_incrementally(self, file_path):
-        """Incrementally read a log file based on a known last position and return new content."""
-
-        # Only open the file if it actually changed to not cause extra load
-        if os.path.getsize(file_path) > self.observed_files.get(file_path, 0):
-            try:
-
-                with open(file_path, 'r', encoding="utf8") as file:
-                    file.seek(self.observed_files.get(file_path, 0))
-                    new_content = file.read()
-                    self.observed_files[file_path] = file.tell()
-                return new_content
-            except PermissionError:
-                return ""
-        else:
-            return ""
-
-    def check_observed_files(self):
-        for file_path in self.observed_files.keys():
-            new_content = self.read_incrementally(file_path)
-            if self.check_log_content(new_content):
-                return True
-
-        return False
+        """Incrementally read a log file in chunks based on a known last position
+        and return the new lines that are interesting."""
+        position = self.observed_files.get(file_path, 0)
+
+        # Only read the file if it actually changed to not cause extra load
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return []
+        size = stat.st_size
+        if file_path in self.file_mtimes:
+            self.file_mtimes[file_path] = stat.st_mtime
+
+        if size < position:
+            # File got truncated or replaced -> start over
+            self.close_handle(file_path)
+            position = 0
+
+        if size == position:
+            return []
+
+        try:
+            handle = self.get_handle(file_path)
+        except PermissionError:
+            return []
+
+        lines = []
+        partial = self.partial_lines.pop(file_path, b"")
+        bytes_read.inc(size - position)
+        handle.seek(position)
+        while position < size:
+            chunk = handle.read(min(self.chunk_size, size - position))
+            if not chunk:
+                break
+            position += len(chunk)
+
+            # Only scan complete lines, carry the rest over to the next chunk
+            data = partial + chunk
+            end = data.rfind(b"\n") + 1
+            lines.extend(self.check_log_content(data, end))
+            partial = data[end:]
+
+            # Keep memory bounded even if a file never writes a newline
+            if len(partial) > self.max_line_length:
+                partial = b""
+
+        self.observed_files[file_path] = position
+        self.checkpoint_dirty = True
+        if partial:
+            self.partial_lines[file_path] = partial
+        return lines
+
+    def read_events(self):
+        """Generator over all new CombatEvents in the observed files"""
+        start = time.perf_counter()
+        with tracing.span("LogReader.read_events", "logreader"):
+            with tracing.span("LogReader.add_new_files", "logreader"):
+                self.add_new_files(skip=False)
+
+            for file_path in list(self.observed_files.keys()):
+                with tracing.span("LogReader.read_incrementally", "logreader", file=file_path):
+                    lines = self.read_incrementally(file_path)
+                if not lines:
+                    continue
+
+                character = self.get_character(file_path)
+                for line in lines:
+                    event = parse_line(line, character, file_path)
+                    if event is None:
+                        continue
+
+                    result = self.rules.evaluate(line, event)
+                    if result is None:
+                        continue
+
+                    event.weight, event.extension = result
+                    events_found.inc()
+                    yield event
+
+            with tracing.span("LogReader.evict_and_checkpoint", "logreader"):
+                self.evict_idle_files()
+                self.save_checkpoint_if_due()
+        files_observed.set(len(self.observed_files))
+        poll_seconds.observe(time.perf_counter() - start)
 
     def check_files(self):
-        self.add_new_files(skip=False)
-        return self.check_observed_files()
+        """Read all new lines and return true if something interesting happened"""
+        found = False
+        for event in self.read_events():
+            if event.weight > 0:
+                found = True
+        return found
+
+    def wait_for_changes(self, timeout):
+        """Block until the log directory changed or timeout seconds passed,
+        return true if the files should be checked"""
+        return self.watcher.wait(timeout)
+
+    def wake(self):
+        """Interrupt wait_for_changes, e.g. to stop"""
+        self.watcher.wake()
+
+    def close(self):
+        self.save_checkpoint()
+        self.watcher.close()
+        for file_path in list(self.file_handles.keys()):
+            self.close_handle(file_path)
@@ -0,0 +1,81 @@
+import contextlib
+import ctypes
+import os
+import shutil
+import signal
+import subprocess
+import sys
+
+
+def popen(command, **kwargs):
+    """Start a process with the lowest CPU and I/O priority so it never competes with the game or OBS"""
+    if sys.platform == "win32":
+        # Idle priority processes also get a low I/O priority
+        kwargs["creationflags"] = (
+            kwargs.get("creationflags", 0) | subprocess.CREATE_NO_WINDOW | subprocess.IDLE_PRIORITY_CLASS
+        )
+        return subprocess.Popen(command, **kwargs)
+
+    # Both wrappers exec the command in the same process, no preexec_fn as that can deadlock in a threaded program
+    command = list(command)
+    nice = shutil.which("nice")
+    if nice is not None:
+        command = [nice, "-n", "19"] + command
+    ionice = shutil.which("ionice")
+    if ionice is not None:
+        command = [ionice, "-c", "3"] + command
+    process = subprocess.Popen(command, **kwargs)
+    if nice is None:
+        # Only a moment late, the process just started
+        with contextlib.suppress(OSError):
+            os.setpriority(os.PRIO_PROCESS, process.pid, 19)
+    return process
+
+
+def wait(process, gate, logger):
+    """Wait for a process to finish, it is paused while the activity gate is closed (i.e. during a fight)"""
+    suspended = False
+    try:
+        while True:
+            try:
+                return process.wait(timeout=0.5)
+            except subprocess.TimeoutExpired:
+                pass
+
+            if suspended == gate.is_open():
+                suspended = not suspended
+                if suspended:
+                    logger.info(f"Pausing process {process.pid} until combat is over")
+                    suspend(process)
+                else:
+                    resume(process)
+    finally:
+        if suspended:
+            resume(process)
+
+
+def suspend(process):
+    """Pause a running process, e.g. while a fight is going on"""
+    if sys.platform == "win32":
+        _nt_process_call(process, "NtSuspendProcess")
+    else:
+        os.kill(process.pid, signal.SIGSTOP)
+
+
+def resume(process):
+    if sys.platform == "win32":
+        _nt_process_call(process, "NtResumeProcess")
+    else:
+        os.kill(process.pid, signal.SIGCONT)
+
+
+def _nt_process_call(process, function):
+    process_suspend_resume = 0x0800
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.OpenProcess(process_suspend_resume, False, process.pid)
+    if not handle:
+        raise ctypes.WinError()
+    try:
+        getattr(ctypes.windll.ntdll, function)(handle)
+    finally:
+        kernel32.CloseHandle(handle)
@@ -0,0 +1,229 @@
+"""Counters, gauges and latency histograms for the hot paths of the recorder
+
+Metrics are registered once at import time of the module that updates them, e.g.
+
+    poll_seconds = metrics.histogram("logreader_poll_seconds", "Duration of one poll of the log directory")
+    poll_seconds.observe(0.002)
+
+and can be read in the Prometheus text format (metrics_http.MetricsServer on localhost) or as a JSON snapshot
+(SnapshotWriter). Updating a metric takes a lock and a few additions, cheap enough for every poll.
+"""
+import bisect
+import json
+import math
+import threading
+import time
+
+import file_mover
+
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.lock = threading.Lock()
+        # label items tuple -> value
+        self.values = {}
+
+    @staticmethod
+    def key(labels):
+        return tuple(sorted(labels.items()))
+
+    @staticmethod
+    def format_labels(key, extra=()):
+        items = list(key) + list(extra)
+        if not items:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+    def samples(self):
+        """Prometheus lines of this metric without the HELP and TYPE header"""
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{self.format_labels(key)} {value}" for key, value in values.items()]
+
+    def snapshot(self):
+        with self.lock:
+            values = dict(self.values)
+        return [{"labels": dict(key), "value": value} for key, value in values.items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, description):
+        super().__init__(name, description)
+        self.function = None
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def set_function(self, function):
+        """Read the value from function() whenever the metric is collected"""
+        self.function = function
+
+    def collect(self):
+        function = self.function
+        if function is not None:
+            try:
+                self.set(function())
+            except Exception:
+                pass
+
+    def samples(self):
+        self.collect()
+        return super().samples()
+
+    def snapshot(self):
+        self.collect()
+        return super().snapshot()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=default_buckets):
+        super().__init__(name, description)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            state["counts"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def copy_values(self):
+        with self.lock:
+            return {key: {"counts": list(state["counts"]), "sum": state["sum"], "count": state["count"]}
+                    for key, state in self.values.items()}
+
+    def samples(self):
+        lines = []
+        for key, state in self.copy_values().items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state["counts"]):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(f"{self.name}_bucket{self.format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {state['sum']}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {state['count']}")
+        return lines
+
+    def quantile(self, counts, count, quantile):
+        """Upper bucket bound the quantile falls into"""
+        rank = quantile * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound if bound != math.inf else None
+        return None
+
+    def snapshot(self):
+        snapshot = []
+        for key, state in self.copy_values().items():
+            count = state["count"]
+            snapshot.append({
+                "labels": dict(key),
+                "count": count,
+                "sum": state["sum"],
+                "mean": state["sum"] / count if count else None,
+                "p50": self.quantile(state["counts"], count, 0.5),
+                "p95": self.quantile(state["counts"], count, 0.95),
+                "p99": self.quantile(state["counts"], count, 0.99),
+            })
+        return snapshot
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric_class, name, description, *args):
+        """Get the metric with this name, creating it on first use"""
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, description, *args)
+            return metric
+
+    def prometheus(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {
+            "time": time.time(),
+            "metrics": {metric.name: {"type": metric.kind, "values": metric.snapshot()} for metric in metrics}
+        }
+
+
+registry = Registry()
+
+
+def counter(name, description):
+    return registry.register(Counter, name, description)
+
+
+def gauge(name, description):
+    return registry.register(Gauge, name, description)
+
+
+def histogram(name, description, buckets=default_buckets):
+    return registry.register(Histogram, name, description, buckets)
+
+
+class SnapshotWriter:
+    """Writes a JSON snapshot of all metrics to a file every interval seconds"""
+
+    def __init__(self, path, interval=60, metrics_registry=None):
+        self.path = path
+        self.interval = interval
+        self.registry = metrics_registry or registry
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.write()
+
+    def write(self):
+        file_mover.atomic_write(self.path, json.dumps(self.registry.snapshot(), indent=2))
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.write()
@@ -0,0 +1,47 @@
+"""Serves the metrics over HTTP, kept out of metrics.py so http.server is only imported when a port is configured"""
+import http.server
+import json
+import threading
+
+import metrics
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = self.server.registry.prometheus().encode("utf8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(self.server.registry.snapshot()).encode("utf8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would flood main.log otherwise
+        pass
+
+
+class MetricsServer:
+    """Serves /metrics (Prometheus text format) and /metrics.json, only on localhost"""
+
+    def __init__(self, port, metrics_registry=None, host="127.0.0.1"):
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.registry = metrics_registry or metrics.registry
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,238 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import tracing
+
+request_seconds = metrics.histogram("obs_request_seconds", "Round trip time of OBS requests")
+request_errors = metrics.counter("obs_request_errors_total", "OBS requests that failed")
+reconnects = metrics.counter("obs_connects_total", "Successful connections to OBS")
+
+
+class ObsConnection:
+    """Long lived connection to OBS that is shared between listener restarts
+
+    Keeps one request connection for recording requests, one for replay buffer requests and an event connection.
+    Each request connection has its own I/O thread so requests keep their order but never block the caller.
+    Lost connections are reestablished in the background with exponential backoff and kept warm with cheap probes.
+    """
+
+    channels = ("record", "replay")
+
+    def __init__(self, host, port, password, logger, probe_interval=10, max_backoff=30, client_factory=None):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.logger = logger
+        self.probe_interval = probe_interval
+        self.max_backoff = max_backoff
+        self.client_factory = client_factory or self.create_client
+
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.generation = 0
+        self.connected = threading.Event()
+        self.last_error = None
+
+        # Objects with on_<event> methods that get OBS events forwarded
+        self.listeners = []
+
+        self.executors = {
+            channel: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"obs-{channel}")
+            for channel in self.channels
+        }
+        self.round_trip_times = {}
+        self.connect_duration = None
+        self.probe_latency = None
+
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.maintain, daemon=True)
+
+    @property
+    def settings(self):
+        return self.host, self.port, self.password
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def close(self):
+        """Stop reconnecting and disconnect once the requests sent so far are done
+
+        Returns right away, a connection attempt or a request can take seconds while OBS does not answer and close is
+        called from the settings window.
+        """
+        self.stop_event.set()
+        self.wake_event.set()
+        threading.Thread(target=self.shut_down, name="obs-close").start()
+
+    def shut_down(self):
+        self.thread.join()
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
+        with self.lock:
+            clients, self.clients = self.clients, {}
+        self.close_clients(clients)
+
+    def flush(self):
+        """Wait until all requests sent so far are done"""
+        for executor in self.executors.values():
+            executor.submit(lambda: None).result()
+
+    def wait_connected(self, timeout=None):
+        return self.connected.wait(timeout)
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def forward_event(self, name, data):
+        with self.lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            callback = getattr(listener, name, None)
+            if callback is not None:
+                callback(data)
+
+    def on_record_state_changed(self, data):
+        """Callback function, do not rename!"""
+        self.forward_event("on_record_state_changed", data)
+
+    def on_replay_buffer_saved(self, data):
+        """Callback function, do not rename!"""
+        self.forward_event("on_replay_buffer_saved", data)
+
+    def create_client(self, channel):
+        # Imported here, it takes longer to import than everything the listener needs before it can watch the logs
+        import obsws_python as obs
+
+        if channel == "events":
+            return obs.EventClient(host=self.host, port=int(self.port), password=self.password, timeout=3)
+        return obs.ReqClient(host=self.host, port=int(self.port), password=self.password, timeout=3)
+
+    @staticmethod
+    def close_clients(clients):
+        for client in clients.values():
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+
+    def connect(self):
+        start = time.perf_counter()
+        clients = {}
+        try:
+            for channel in self.channels + ("events",):
+                clients[channel] = self.client_factory(channel)
+        except Exception:
+            self.close_clients(clients)
+            raise
+        clients["events"].callback.register([self.on_record_state_changed, self.on_replay_buffer_saved])
+
+        with self.lock:
+            old_clients, self.clients = self.clients, clients
+            self.generation += 1
+        self.close_clients(old_clients)
+
+        self.connect_duration = time.perf_counter() - start
+        reconnects.inc()
+        self.last_error = None
+        self.connected.set()
+        self.logger.info(f"Connected to OBS in {self.connect_duration * 1000:.1f}ms")
+
+    def mark_disconnected(self, error, generation):
+        """Called when a request failed because of the connection, the background thread will reconnect"""
+        with self.lock:
+            # Errors of connections that were already replaced don't matter anymore
+            if generation != self.generation:
+                return
+            self.generation += 1
+        self.last_error = error
+        self.connected.clear()
+        self.wake_event.set()
+        self.logger.warning(f"Lost connection to OBS: {error!r}")
+
+    def request(self, channel, name):
+        """Send an OBS request on a channel in the background and return its future"""
+
+        def send():
+            from obsws_python.error import OBSSDKRequestError
+
+            with self.lock:
+                client = self.clients.get(channel)
+                generation = self.generation
+            if client is None or not self.connected.is_set():
+                raise ConnectionError("Not connected to OBS")
+
+            start = time.perf_counter()
+            try:
+                with tracing.span(f"obs {name}", "obs", channel=channel):
+                    return getattr(client, name)()
+            except OBSSDKRequestError:
+                # OBS answered, the connection itself is fine
+                request_errors.inc(request=name)
+                raise
+            except Exception as e:
+                request_errors.inc(request=name)
+                self.mark_disconnected(e, generation)
+                raise
+            finally:
+                self.round_trip_times[name] = time.perf_counter() - start
+                request_seconds.observe(self.round_trip_times[name], request=name)
+                self.logger.debug(f"OBS request {name} took {self.round_trip_times[name] * 1000:.1f}ms")
+
+        return self.executors[channel].submit(send)
+
+    def probe(self):
+        """Check that all connections are still alive, return true if they are"""
+        with self.lock:
+            event_client = self.clients.get("events")
+            generation = self.generation
+
+        # The event client stops its worker thread silently when the connection drops
+        worker = getattr(event_client, "worker", None)
+        if worker is not None and not worker.is_alive():
+            self.mark_disconnected(ConnectionError("OBS event connection closed"), generation)
+            return False
+
+        for channel in self.channels:
+            try:
+                self.request(channel, "get_version").result()
+            except Exception:
+                return False
+        self.probe_latency = self.round_trip_times.get("get_version")
+        return True
+
+    def maintain(self):
+        """Background thread keeping the connection alive"""
+        # obsws_python logs every connection attempt with the password and every failed one with a traceback
+        obs_logger = logging.getLogger("obsws_python")
+        backoff = 0.5
+        while not self.stop_event.is_set():
+            if not self.connected.is_set():
+                level = obs_logger.level
+                obs_logger.setLevel(logging.CRITICAL)
+                try:
+                    self.connect()
+                    backoff = 0.5
+                except Exception as e:
+                    self.last_error = e
+                    self.logger.info(f"Could not connect to OBS, retrying in {backoff}s: {e!r}")
+                    self.stop_event.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                finally:
+                    obs_logger.setLevel(level)
+                continue
+
+            self.wake_event.wait(self.probe_interval)
+            self.wake_event.clear()
+            if self.connected.is_set() and not self.stop_event.is_set():
+                self.probe()
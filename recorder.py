@@ -1,53 +1,174 @@
+import collections
 import datetime
+import functools
+import threading
+import time
 
-import obsws_python as obs
+import metrics
+
+trigger_to_record_seconds = metrics.histogram(
+    "recorder_trigger_to_start_record_seconds", "Time from a triggering log line until OBS started recording"
+)
+
+class FightSession:
+    """Everything OBS told us about the files of one fight, filled in from its events"""
+
+    def __init__(self, start_time):
+        self.start_time = start_time
+        # time.monotonic() of the line that started the fight
+        self.triggered_at = time.monotonic()
+        self.replay_path = None
+        self.recording_path = None
+        # Wall clock times of the OBS events, used to find the overlap of both files
+        self.replay_saved_at = None
+        self.recording_started_at = None
+        self.replay_saved = threading.Event()
+        self.recording_stopped = threading.Event()
+
+    @property
+    def output_name(self):
+        return self.start_time.strftime("%Y%m%d-%H%M%S")
+
+    def wait(self, timeout=None):
+        """Wait until OBS is done with both files, return true if it reported both in time"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self.replay_saved.wait(timeout):
+            return False
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        return self.recording_stopped.wait(remaining)
 
 
 class TimeoutRecording:
-    def __init__(self, host, port, password, logger, timeout=60):
-        self.ws = obs.ReqClient(host=host, port=port, password=password, timeout=3)
+    def __init__(self, connection, logger, timeout=60):
+        self.connection = connection
         self.start_time = None
-        self.end_time = None
+        # time.monotonic() the recording stops at, wall clock jumps must not cut a fight short or make it longer
+        self.deadline = None
         self.logger = logger
         self.timeout = timeout
 
-        # Register callback to get information on the current recording path
-        self.cl = obs.EventClient(host=host, port=port, password=password)
-        self.cl.callback.register(self.on_record_state_changed)
-        self.recording_path = None
+        # Fights waiting for their OBS events, in the order the requests were sent
+        self.session = None
+        # Set when OBS did not start recording for the current fight, see check_cancelled()
+        self.cancelled = False
+        self.session_lock = threading.Lock()
+        self.replay_sessions = collections.deque()
+        self.recording_sessions = collections.deque()
+
+        # Get OBS events to learn the file paths of the current fight
+        self.connection.add_listener(self)
 
     def on_record_state_changed(self, data):
         """Callback function, do not rename!"""
-        if data.output_path is not None:
-            self.recording_path = data.output_path
+        with self.session_lock:
+            if data.output_state == "OBS_WEBSOCKET_OUTPUT_STARTED":
+                for session in self.recording_sessions:
+                    if session.recording_path is None:
+                        session.recording_path = data.output_path
+                        session.recording_started_at = time.time()
+                        break
+            elif data.output_state == "OBS_WEBSOCKET_OUTPUT_STOPPED" and self.recording_sessions:
+                # Once OBS reports the output as stopped the file is complete
+                session = self.recording_sessions.popleft()
+                if data.output_path is not None:
+                    session.recording_path = data.output_path
+                session.recording_stopped.set()
+
+    def on_replay_buffer_saved(self, data):
+        """Callback function, do not rename!"""
+        with self.session_lock:
+            if self.replay_sessions:
+                session = self.replay_sessions.popleft()
+                session.replay_path = data.saved_replay_path
+                session.replay_saved_at = time.time()
+                session.replay_saved.set()
+
+    def request(self, channel, name, session):
+        """Send an OBS request in the background"""
+        future = self.connection.request(channel, name)
+        future.add_done_callback(functools.partial(self.on_request_done, name, session))
+        return future
+
+    def on_request_done(self, name, session, future):
+        if future.cancelled():
+            return
+        if future.exception() is None:
+            if name == "start_record":
+                trigger_to_record_seconds.observe(time.monotonic() - session.triggered_at)
+            self.logger.info(f"OBS request {name} took {self.connection.round_trip_times[name] * 1000:.1f}ms")
+            return
+
+        # No event will come for a failed request -> don't let the fight wait for it
+        with self.session_lock:
+            if name == "start_record":
+                # OBS is probably recording already (started by hand), that recording is not ours to stop or claim
+                if session in self.recording_sessions:
+                    self.recording_sessions.remove(session)
+                if self.session is session:
+                    self.deadline = None
+                    self.session = None
+                    self.cancelled = True
+            elif name == "save_replay_buffer" and session in self.replay_sessions:
+                self.replay_sessions.remove(session)
+                session.replay_saved.set()
+            elif name == "stop_record" and session in self.recording_sessions:
+                self.recording_sessions.remove(session)
+                session.recording_stopped.set()
+
+        # OBS refused (e.g. it is already recording) or is not reachable, the connection handles reconnecting
+        self.logger.error(f"Got an error from OBS for {name}", exc_info=future.exception())
+
+    def close(self):
+        self.connection.remove_listener(self)
 
     @property
-    def replay_path(self):
-        return self.ws.get_last_replay_buffer_replay().saved_replay_path
+    def recording(self):
+        return self.deadline is not None
 
     @property
     def output_name(self):
-        return self.start_time.strftime("%Y%m%d-%H%M%S")
+        return self.session.output_name
+
+    def time_left(self):
+        """Seconds until the recording times out, None if not recording"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
 
     def check_timeout(self):
-        if self.end_time is not None and self.end_time < datetime.datetime.now():
-            self.ws.stop_record()
-            self.end_time = None
-            return True
-        return False
-
-    def set_timeout(self):
-        if self.end_time is None:
-            try:
-                self.ws.start_record()
-                self.ws.save_replay_buffer()
-                self.end_time = datetime.datetime.now() + datetime.timedelta(seconds=self.timeout)
-                self.start_time = datetime.datetime.now()
-            except obs.error.OBSSDKRequestError:
-                self.logger.error("Got an error while trying to start recording", exc_info=True)
-                # OBS is already recording -> do nothing
-                pass
-            return True
-        else:
-            self.end_time = datetime.datetime.now() + datetime.timedelta(seconds=self.timeout)
-            return False
+        # The lock keeps a failed start_record from being stopped, the recording would not be ours
+        with self.session_lock:
+            if self.deadline is None or self.deadline > time.monotonic():
+                return False
+            self.deadline = None
+            session = self.session
+        self.request("record", "stop_record", session)
+        return True
+
+    def check_cancelled(self):
+        """True once after a fight was dropped because OBS did not start recording it"""
+        with self.session_lock:
+            cancelled, self.cancelled = self.cancelled, False
+        return cancelled
+
+    def set_timeout(self, extension=0):
+        deadline = time.monotonic() + self.timeout + extension
+        with self.session_lock:
+            if self.deadline is not None:
+                # Never cut short a longer extension from an earlier line
+                self.deadline = max(self.deadline, deadline)
+                return False
+
+            self.deadline = deadline
+            self.cancelled = False
+            self.start_time = datetime.datetime.now()
+            self.session = FightSession(self.start_time)
+            self.replay_sessions.append(self.session)
+            self.recording_sessions.append(self.session)
+            session = self.session
+
+        # Start recording and save the replay buffer at the same time, outside the lock as a request that is done
+        # already calls on_request_done right away
+        self.request("record", "start_record", session)
+        self.request("replay", "save_replay_buffer", session)
+        return True
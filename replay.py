@@ -0,0 +1,328 @@
+"""Offline replay of recorded gamelogs through the whole recording pipeline
+
+Copies the lines of an existing gamelog directory into a temporary directory, paced by their original timestamps,
+while the normal listener, TimeoutRecording and VideoProcessingPipeline run against a stand-in OBS. Reports when
+each recording would have started and stopped and how long it took from the triggering line to the recording, e.g.:
+
+    python replay.py "C:/Users/me/Documents/EVE/logs/Gamelogs" --speed 10 --max-gap 30
+"""
+import argparse
+import datetime
+import heapq
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import tracing
+from combat_events import parse_line, parse_timestamp
+from listener_thread import ListenerStopEvent, RecordingStatusCallback, run
+from obs_connection import ObsConnection
+from trigger_rules import TriggerRules
+from video_processing import VideoProcessingPipeline
+
+
+class StandInObs:
+    """Minimal in-process OBS replacement implementing the requests and events TimeoutRecording uses,
+    it writes small dummy files in place of real videos"""
+
+    def __init__(self, directory, replay):
+        self.directory = directory
+        self.replay = replay
+        self.callbacks = []
+        self.recordings = []
+        self.recording_path = None
+        self.replay_path = None
+        self.callback = self
+
+    # EventClient interface
+    def register(self, functions):
+        self.callbacks.extend(functions)
+
+    def emit(self, event_name, **data):
+        for function in self.callbacks:
+            if function.__name__ == event_name:
+                function(SimpleNamespace(**data))
+
+    def new_file(self, kind):
+        file_path = os.path.join(self.directory, f"{kind}_{len(self.recordings)}.mkv").replace("\\", "/")
+        with open(file_path, 'wb') as f:
+            f.write(b"\0" * 1024)
+        return file_path
+
+    # ReqClient interface
+    def start_record(self):
+        started = self.replay.now()
+        self.recording_path = self.new_file("recording")
+        self.recordings.append({"started": started, "stopped": None})
+        self.emit("on_record_state_changed", output_active=True, output_state="OBS_WEBSOCKET_OUTPUT_STARTED",
+                  output_path=self.recording_path)
+
+    def stop_record(self):
+        self.recordings[-1]["stopped"] = self.replay.now()
+        self.emit("on_record_state_changed", output_active=False, output_state="OBS_WEBSOCKET_OUTPUT_STOPPED",
+                  output_path=self.recording_path)
+        return SimpleNamespace(output_path=self.recording_path)
+
+    def save_replay_buffer(self):
+        self.replay_path = self.new_file("replay")
+        self.emit("on_replay_buffer_saved", saved_replay_path=self.replay_path)
+
+    def get_last_replay_buffer_replay(self):
+        return SimpleNamespace(saved_replay_path=self.replay_path)
+
+    def get_version(self):
+        return SimpleNamespace(obs_version="stand-in")
+
+    def disconnect(self):
+        pass
+
+
+class LogReplay:
+    """Write the lines of a gamelog directory into another directory, paced by their timestamps"""
+
+    def __init__(self, source, target, speed, max_gap, trigger_rules):
+        self.source = source
+        self.target = target
+        self.speed = speed
+        self.max_gap = max_gap
+        self.rules = TriggerRules(trigger_rules)
+
+        self.wall_start = None
+        self.log_start = None
+        self.current_log_time = None
+        self.current_wall_time = None
+        self.triggers = []
+
+    def now(self):
+        """Current wall and (estimated) log time as a dict"""
+        wall_time = time.monotonic()
+        log_time = None
+        if self.current_log_time is not None:
+            log_time = self.current_log_time + datetime.timedelta(
+                seconds=(wall_time - self.current_wall_time) * self.speed
+            )
+        return {"wall": wall_time, "log_time": log_time}
+
+    def read_file(self, file_name):
+        """Yield (log_time, file_name, data) for a gamelog, lines without a timestamp stick to the next line"""
+        pending = b""
+        with open(os.path.join(self.source, file_name), 'rb') as f:
+            for line in f:
+                if not line.startswith(b"[ "):
+                    pending += line
+                    continue
+                try:
+                    log_time = parse_timestamp(line[2:21].decode("ascii"))
+                except (ValueError, UnicodeDecodeError):
+                    pending += line
+                    continue
+                yield log_time, file_name, pending + line
+                pending = b""
+
+    def run(self):
+        files = sorted(file_name for file_name in os.listdir(self.source)
+                       if os.path.isfile(os.path.join(self.source, file_name)))
+        lines = heapq.merge(*(self.read_file(file_name) for file_name in files), key=lambda item: item[0])
+
+        handles = {}
+        skipped = 0
+        last_offset = 0
+        self.wall_start = time.monotonic()
+        try:
+            for log_time, file_name, data in lines:
+                if self.log_start is None:
+                    self.log_start = log_time
+
+                # Compress long idle gaps so replaying a whole evening does not take a whole evening
+                offset = (log_time - self.log_start).total_seconds() - skipped
+                if self.max_gap is not None and offset - last_offset > self.max_gap:
+                    skipped += offset - last_offset - self.max_gap
+                    offset = last_offset + self.max_gap
+                last_offset = offset
+
+                delay = self.wall_start + offset / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+                # Take the time before writing, the listener might pick the line up right away
+                self.current_log_time = log_time
+                self.current_wall_time = time.monotonic()
+
+                handle = handles.get(file_name)
+                if handle is None:
+                    handle = open(os.path.join(self.target, file_name), 'ab')
+                    handles[file_name] = handle
+                handle.write(data)
+                handle.flush()
+
+                # Remember which lines should trigger a recording to measure the latency later on
+                if self.rules.regex.search(data):
+                    line = data.splitlines()[-1].decode("utf8", errors="replace")
+                    result = self.rules.evaluate(line, parse_line(line, None, file_name))
+                    if result is not None and result[0] > 0:
+                        self.triggers.append({"wall": self.current_wall_time, "log_time": log_time,
+                                              "file": file_name, "line": line})
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+
+def build_report(replay, obs):
+    """Match every recording with the line that triggered it"""
+    report = []
+    trigger_index = 0
+    for recording in obs.recordings:
+        started = recording["started"]
+        stopped = recording["stopped"]
+
+        # The trigger is the first trigger line written before the recording started
+        trigger = None
+        while trigger_index < len(replay.triggers) and replay.triggers[trigger_index]["wall"] <= started["wall"]:
+            if trigger is None:
+                trigger = replay.triggers[trigger_index]
+            trigger_index += 1
+
+        # Skip over the lines that only kept this recording running
+        if stopped is not None:
+            while trigger_index < len(replay.triggers) and replay.triggers[trigger_index]["wall"] <= stopped["wall"]:
+                trigger_index += 1
+
+        entry = {
+            "started": str(started["log_time"]),
+            "stopped": str(stopped["log_time"]) if stopped is not None else None,
+            "duration_seconds": (stopped["wall"] - started["wall"]) * replay.speed if stopped is not None else None,
+        }
+        if trigger is not None:
+            entry["trigger_file"] = trigger["file"]
+            entry["trigger_line"] = trigger["line"]
+            entry["trigger_latency_ms"] = (started["wall"] - trigger["wall"]) * 1000
+        report.append(entry)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded gamelogs through the recording pipeline")
+    parser.add_argument("log_dir", help="directory with the gamelogs to replay")
+    parser.add_argument("--settings", help="settings.json to take TIMEOUT and TRIGGER_RULES from")
+    parser.add_argument("--timeout", type=float, help="recording timeout in log seconds (overrides settings)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 1 is real time")
+    parser.add_argument("--max-gap", type=float, help="compress idle gaps longer than this many seconds")
+    parser.add_argument("--output", help="write the report to this file instead of stdout")
+    parser.add_argument("--profile", metavar="TRACE_FILE", help="write a Chrome trace format span trace")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.speed <= 0:
+        parser.error("--speed has to be positive")
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+    logger = logging.getLogger("replay")
+    if args.profile:
+        tracing.start(args.profile)
+
+    settings = {"TIMEOUT": "60"}
+    if args.settings:
+        with open(args.settings, 'r') as f:
+            settings.update(json.load(f))
+    if args.timeout is not None:
+        settings["TIMEOUT"] = args.timeout
+
+    work_path = tempfile.mkdtemp(prefix="fight_recorder_replay_")
+    log_dir = os.path.join(work_path, "logs")
+    obs_dir = os.path.join(work_path, "obs")
+    output_dir = os.path.join(work_path, "output")
+    for directory in (log_dir, obs_dir, output_dir):
+        os.mkdir(directory)
+
+    timeout = float(settings["TIMEOUT"])
+    trigger_rules = settings.get("TRIGGER_RULES")
+    replay = LogReplay(args.log_dir, log_dir, args.speed, args.max_gap, trigger_rules)
+    max_extend = max((rule.extend for rule in replay.rules.rules), default=0)
+
+    # Timeouts, extensions and intervals run on the wall clock, so they have to be scaled with the replay
+    settings.update({
+        "LOG_DIR": log_dir,
+        "OUTPUT_DIR": output_dir,
+        "TIMEOUT": timeout / args.speed,
+        "POLL_INTERVAL_IDLE": float(settings.get("POLL_INTERVAL_IDLE", 2)) / args.speed,
+        "POLL_INTERVAL_COMBAT": float(settings.get("POLL_INTERVAL_COMBAT", 0.25)) / args.speed,
+    })
+    if trigger_rules:
+        settings["TRIGGER_RULES"] = [
+            dict(rule, extend=float(rule.get("extend", 0)) / args.speed) for rule in trigger_rules
+        ]
+    quiet_period = float(settings.get("PROCESSING_QUIET_PERIOD", 60)) / args.speed
+
+    obs = StandInObs(obs_dir, replay)
+    status_messages = []
+    listener_started = threading.Event()
+
+    def status_callback(message):
+        logger.info(f"Got status message: {message}.")
+        status_messages.append(message)
+        # The first ready or error message comes once the log directory is watched, or the listener failed
+        if message == RecordingStatusCallback.RECORDING_READY or (
+                type(message) is tuple and message[0] == RecordingStatusCallback.RECORDING_ERROR):
+            listener_started.set()
+
+    connection = ObsConnection("localhost", 0, "", logger, client_factory=lambda channel: obs).start()
+
+    pipeline = VideoProcessingPipeline(
+        auto_concatenate=False,
+        delete=False,
+        status_callback=status_callback,
+        logger=logger,
+        files_path=work_path,
+        quiet_period=quiet_period
+    )
+
+    stop_event = ListenerStopEvent()
+    listener_thread = threading.Thread(
+        target=run,
+        args=(settings, status_callback, stop_event, pipeline, logger, work_path, connection)
+    )
+    listener_thread.start()
+
+    try:
+        # Lines written before the listener watches the directory would be skipped as old
+        listener_started.wait()
+        if listener_thread.is_alive():
+            replay.run()
+
+            # Let the last recording run into its timeout
+            time.sleep((timeout + max_extend) / args.speed + 2)
+    finally:
+        stop_event.set()
+        listener_thread.join()
+        connection.close()
+        pipeline.close()
+        tracing.stop()
+
+    report = {
+        "log_dir": args.log_dir,
+        "speed": args.speed,
+        "timeout": timeout,
+        "log_start": str(replay.log_start),
+        "log_end": str(replay.current_log_time),
+        "trigger_lines": len(replay.triggers),
+        "errors": [str(message) for message in status_messages if isinstance(message, tuple)],
+        "recordings": build_report(replay, obs),
+    }
+    shutil.rmtree(work_path, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
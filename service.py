@@ -0,0 +1,172 @@
+import os
+import threading
+import weakref
+
+import metrics
+from app_settings import app_paths
+from job_journal import JobJournal
+from job_scheduler import ActivityGate
+from library import OutputLibrary
+from listener_thread import ListenerStopEvent, run
+from obs_connection import ObsConnection
+from tools import ToolProvisioner
+from video_processing import VideoProcessingPipeline
+
+pending_jobs = metrics.gauge("processing_queue_depth", "Processing jobs queued, waiting or running")
+
+
+class RecorderService:
+    """Everything that records and processes fights, without any user interface
+
+    Owns the OBS connection, ffmpeg, the processing pipeline, the output library and the listener thread, the GUI and
+    the headless daemon both run one. status_callback gets the status messages of the listener and the pipeline.
+    """
+
+    def __init__(self, settings, files_path, status_callback, logger):
+        self.settings = settings
+        self.files_path = files_path
+        self.status_callback = status_callback
+        self.logger = logger
+
+        # Processing state of every fight, survives restarts of the pipeline and the program
+        self.journal = JobJournal(os.path.join(files_path, "processing_journal.jsonl"))
+
+        # Shared by all pipelines and libraries, work of a pipeline that was replaced by a settings change still has
+        # to wait for combat to be over
+        self.gate = ActivityGate()
+        self.tools = None
+        self.stop_event = ListenerStopEvent()
+        self.listener_thread = None
+        self.obs_connection = None
+        self.video_processing_pipeline = None
+        # Pipelines replaced by a settings change keep finishing their jobs, they count until they are gone
+        self.pipelines = weakref.WeakSet()
+        pending_jobs.set_function(lambda: sum(pipeline.queue_depth for pipeline in list(self.pipelines)))
+        self.library = None
+        self.metrics_server = None
+        self.metrics_snapshots = None
+
+    def start_metrics(self):
+        """Serve metrics on localhost if a port is configured and write snapshots to metrics.json"""
+        metrics_port = int(self.settings.get("METRICS_PORT", 0) or 0)
+        if metrics_port:
+            import metrics_http
+
+            try:
+                self.metrics_server = metrics_http.MetricsServer(metrics_port).start()
+                self.logger.info(f"Serving metrics on http://127.0.0.1:{self.metrics_server.port}/metrics")
+            except OSError:
+                self.logger.error(f"Could not serve metrics on port {metrics_port}", exc_info=True)
+
+        snapshot_interval = float(self.settings.get("METRICS_SNAPSHOT_INTERVAL", 60) or 0)
+        if snapshot_interval > 0:
+            self.metrics_snapshots = metrics.SnapshotWriter(
+                os.path.join(self.files_path, "metrics.json"), snapshot_interval
+            ).start()
+
+    def start(self):
+        """(Re)start the listener with the current settings"""
+        # Stop the previous listener first, the logs are watched again as soon as possible below
+        if self.listener_thread:
+            self.stop_event.set()
+            self.listener_thread.join()
+            self.stop_event.clear()
+
+        # Let a previous pipeline finish its jobs in the background
+        first_pipeline = self.video_processing_pipeline is None
+        if not first_pipeline:
+            self.library.close()
+            self.video_processing_pipeline.close()
+
+        # A failed download is tried again with every restart
+        if self.tools is None or (self.tools.done.is_set() and not self.tools.ready):
+            # Bundled next to the program or, from older versions, extracted into a directory called ffmpeg.exe
+            self.tools = ToolProvisioner(
+                os.path.join(self.files_path, "tools"),
+                os.path.join(self.files_path, "tools.json"),
+                self.logger,
+                url=self.settings.get("FFMPEG_URL"),
+                sha256=self.settings.get("FFMPEG_SHA256"),
+                search_paths=[app_paths()[1], self.files_path, os.path.join(self.files_path, "ffmpeg.exe")]
+            )
+
+        self.gate.quiet_period = float(self.settings.get("PROCESSING_QUIET_PERIOD", 60))
+        self.video_processing_pipeline = VideoProcessingPipeline(
+            auto_concatenate=bool(self.settings["CONCATENATE_OUTPUTS"]),
+            delete=bool(self.settings["DELETE_ORIGINALS"]),
+            status_callback=self.status_callback,
+            logger=self.logger,
+            files_path=self.files_path,
+            workers=int(self.settings.get("PROCESSING_WORKERS", 2)),
+            read_rate=float(self.settings.get("PROCESSING_READ_RATE", 0)),
+            tools=self.tools,
+            journal=self.journal,
+            gate=self.gate
+        )
+        self.pipelines.add(self.video_processing_pipeline)
+
+        # Keep the OBS connection across restarts unless its settings changed
+        obs_settings = (self.settings["OBS_HOST"], self.settings["OBS_PORT"], self.settings["OBS_PASSWORD"])
+        if self.obs_connection is None or self.obs_connection.settings != obs_settings:
+            if self.obs_connection is not None:
+                self.obs_connection.close()
+            self.obs_connection = ObsConnection(*obs_settings, logger=self.logger).start()
+
+        self.listener_thread = threading.Thread(
+            target=run,
+            args=(
+                self.settings,
+                self.status_callback,
+                self.stop_event,
+                self.video_processing_pipeline,
+                self.logger,
+                self.files_path,
+                self.obs_connection
+            ),
+            name="listener"
+        )
+        self.listener_thread.start()
+
+        # Finding or downloading ffmpeg must not hold up watching the logs, jobs wait for it instead
+        if self.tools.thread.ident is None:
+            self.tools.start()
+
+        # Retention and re-encoding wait for combat to be over just like the pipeline
+        self.library = OutputLibrary(
+            self.settings["OUTPUT_DIR"],
+            os.path.join(self.files_path, "library_index.json"),
+            logger=self.logger,
+            gate=self.gate,
+            max_bytes=float(self.settings.get("LIBRARY_MAX_GB", 0)) * 1024 ** 3,
+            max_age=float(self.settings.get("LIBRARY_MAX_AGE_DAYS", 0)) * 24 * 60 * 60,
+            reencode_age=float(self.settings.get("LIBRARY_REENCODE_AFTER_DAYS", 0)) * 24 * 60 * 60,
+            codec=self.settings.get("LIBRARY_REENCODE_CODEC", "libx265"),
+            crf=self.settings.get("LIBRARY_REENCODE_CRF", "28"),
+            tools=self.tools,
+            in_use=lambda: {entry["name"] for entry in self.journal.unfinished()}
+        ).start()
+        self.video_processing_pipeline.library = self.library
+
+        # Pick up the work left over from the last time the program ran
+        if first_pipeline:
+            self.video_processing_pipeline.resume()
+
+    def concatenate_candidates(self):
+        self.video_processing_pipeline.concatenate_candidates()
+
+    def close(self):
+        self.stop_event.set()
+        if self.listener_thread:
+            self.listener_thread.join()
+        if self.obs_connection is not None:
+            self.obs_connection.close()
+        if self.library is not None:
+            self.library.close()
+        if self.video_processing_pipeline is not None:
+            # No more fights are recorded, let the remaining jobs run
+            self.gate.release()
+            self.video_processing_pipeline.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        if self.metrics_snapshots is not None:
+            self.metrics_snapshots.close()
@@ -0,0 +1,121 @@
+import bisect
+import json
+import os
+import subprocess
+import sys
+
+
+class ProbeResult:
+    """Timestamps of a video file as reported by ffprobe, all in seconds"""
+
+    def __init__(self, start_time, duration):
+        self.start_time = start_time
+        self.duration = duration
+
+
+def run_ffprobe(ffprobe, arguments):
+    creation_flags = 0
+    if sys.platform == "win32":
+        creation_flags = subprocess.CREATE_NO_WINDOW
+
+    result = subprocess.run(
+        [ffprobe, "-v", "error"] + arguments,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        creationflags=creation_flags
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed with return code {result.returncode}: {result.stderr.strip()}")
+    return result.stdout
+
+
+def probe(ffprobe, file_path):
+    """Get start time and duration of a file"""
+    output = json.loads(run_ffprobe(ffprobe, [
+        "-show_entries", "format=start_time,duration",
+        "-of", "json",
+        file_path
+    ]))["format"]
+    return ProbeResult(float(output.get("start_time", 0)), float(output["duration"]))
+
+
+def probe_keyframes(ffprobe, file_path, window=None):
+    """Timestamps of the video keyframes, only reads packet headers and optionally only the first window seconds"""
+    arguments = ["-select_streams", "v:0", "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0"]
+    if window is not None:
+        arguments += ["-read_intervals", f"%+{window:.3f}"]
+
+    keyframes = []
+    for line in run_ffprobe(ffprobe, arguments + [file_path]).splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time))
+    keyframes.sort()
+    return keyframes
+
+
+def nearest_keyframe(keyframes, position):
+    """Keyframe closest to position, None if there are no keyframes"""
+    if not keyframes:
+        return None
+    index = bisect.bisect_left(keyframes, position)
+    candidates = keyframes[max(0, index - 1):index + 1]
+    return min(candidates, key=lambda keyframe: abs(keyframe - position))
+
+
+class StitchPlan:
+    """How to join replay and recording: inpoint is where the recording starts (None to keep all of it),
+    duration the expected length of the output in seconds"""
+
+    def __init__(self, inpoint, duration):
+        self.inpoint = inpoint
+        self.duration = duration
+
+
+def plan_stitch(ffprobe, replay_path, recording_path, replay_end=None, recording_start=None):
+    """Probe both files and plan the stitching"""
+    replay = probe(ffprobe, replay_path)
+    recording = probe(ffprobe, recording_path)
+    inpoint = recording_inpoint(ffprobe, replay_path, recording_path, replay, recording, replay_end, recording_start)
+
+    duration = replay.duration + recording.duration
+    if inpoint is not None:
+        duration -= inpoint - recording.start_time
+    return StitchPlan(inpoint, duration)
+
+
+def recording_inpoint(ffprobe, replay_path, recording_path, replay, recording, replay_end=None, recording_start=None):
+    """Where the recording has to start so it continues the replay without repeating it
+
+    replay_end and recording_start are the wall clock times (time.time()) the replay buffer was saved and the
+    recording started, without them the file modification times are used. The overlap is cut at the nearest
+    keyframe of the recording so the stream copy stays exact. Returns None if there is nothing to cut.
+    """
+    if replay_end is None or recording_start is None:
+        # Both files were last written when OBS finished them
+        replay_end = os.path.getmtime(replay_path)
+        recording_start = os.path.getmtime(recording_path) - recording.duration
+
+    # The replay can't overlap the recording by more than it is long
+    overlap = min(replay_end - recording_start, replay.duration)
+    if overlap <= 0 or overlap >= recording.duration:
+        return None
+
+    keyframes = probe_keyframes(ffprobe, recording_path, window=overlap + 10)
+    inpoint = nearest_keyframe(keyframes, recording.start_time + overlap)
+    if inpoint is None or inpoint <= recording.start_time:
+        return None
+    return inpoint
+
+
+def write_concat_list(list_path, replay_path, recording_path, inpoint=None):
+    """Concat demuxer input list, the recording starts at inpoint if given"""
+    lines = [
+        f"file '{replay_path}'\n",
+        f"file '{recording_path}'\n"
+    ]
+    if inpoint is not None:
+        lines.append(f"inpoint {inpoint:.6f}\n")
+    with open(list_path, 'w') as concat_file:
+        concat_file.writelines(lines)
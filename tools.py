@@ -0,0 +1,283 @@
+"""Finds or downloads ffmpeg and ffprobe without ever blocking the start of the program
+
+    tools = ToolProvisioner(os.path.join(files_path, "tools"), os.path.join(files_path, "tools.json"), logger).start()
+    ffmpeg, ffprobe = tools.wait()
+"""
+import contextlib
+import hashlib
+import json
+import os
+import pathlib
+import re
+import shutil
+import stat
+import subprocess
+import sys
+import tarfile
+import threading
+import urllib.error
+import urllib.request
+import zipfile
+
+import file_mover
+
+if sys.platform == "win32":
+    default_url = ("https://github.com/BtbN/FFmpeg-Builds/releases/download/autobuild-2024-09-30-15-36/"
+                   "ffmpeg-n7.1-win64-gpl-7.1.zip")
+    executable_suffix = ".exe"
+else:
+    # There is no single build for every other platform, ffmpeg comes from the package manager there
+    default_url = None
+    executable_suffix = ""
+
+# The concat inpoint and -readrate need ffmpeg 5 or newer
+minimum_version = (5, 0)
+# e.g. "ffmpeg version n7.1 Copyright ...", builds from git have no version number and count as new enough
+version_regex = re.compile(r"version (\S+)")
+number_regex = re.compile(r"^\D*(\d+)\.(\d+)")
+
+
+class ToolProvisioner:
+    """Provides the ffmpeg and ffprobe executables the pipeline runs
+
+    Looks on PATH, next to the program (bundled) and in directory (downloaded earlier), in that order, and downloads
+    an archive from url into directory if neither has both tools. The result is kept in cache_path together with
+    the version and the size and modification time of both files, later starts only stat them. Downloads resume
+    where they stopped and are checked against sha256 or the checksums.sha256 next to the archive. url can also be
+    a local mirror, a file:// url or a plain path.
+    """
+
+    def __init__(self, directory, cache_path, logger, url=None, sha256=None, search_paths=()):
+        self.directory = directory
+        self.cache_path = cache_path
+        self.logger = logger
+        self.url = url or default_url
+        self.sha256 = sha256.lower() if sha256 else None
+        self.search_paths = list(search_paths)
+
+        self.ffmpeg = None
+        self.ffprobe = None
+        self.version = None
+        self.error = None
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="tools", daemon=True)
+
+    @property
+    def ready(self):
+        return self.ffmpeg is not None
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        """(ffmpeg, ffprobe), waits until they were found or downloaded"""
+        if not self.done.wait(timeout):
+            raise TimeoutError("ffmpeg is still being downloaded")
+        if not self.ready:
+            raise RuntimeError(f"ffmpeg is not available: {self.error}")
+        return self.ffmpeg, self.ffprobe
+
+    def run(self):
+        try:
+            tools = self.cached() or self.find() or self.download()
+            self.ffmpeg, self.ffprobe, self.version = tools
+            self.logger.info(f"Using ffmpeg {self.version} from {self.ffmpeg}")
+        except Exception as e:
+            self.error = e
+            self.logger.error("Could not provide ffmpeg and ffprobe", exc_info=True)
+        finally:
+            self.done.set()
+
+    @staticmethod
+    def file_state(path):
+        file_stat = os.stat(path)
+        return [file_stat.st_size, file_stat.st_mtime_ns]
+
+    def cached(self):
+        """Tools from the cache file if both files are unchanged since they were checked"""
+        try:
+            with open(self.cache_path, 'r') as f:
+                cache = json.load(f)
+            if all(self.file_state(cache[name]) == cache[f"{name}_state"] for name in ("ffmpeg", "ffprobe")):
+                return cache["ffmpeg"], cache["ffprobe"], cache["version"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def save_cache(self, ffmpeg, ffprobe, version):
+        cache = {
+            "ffmpeg": ffmpeg,
+            "ffmpeg_state": self.file_state(ffmpeg),
+            "ffprobe": ffprobe,
+            "ffprobe_state": self.file_state(ffprobe),
+            "version": version
+        }
+        file_mover.atomic_write(self.cache_path, json.dumps(cache, indent=2))
+
+    def candidates(self):
+        """(ffmpeg, ffprobe) pairs in the order they are tried"""
+        yield shutil.which("ffmpeg"), shutil.which("ffprobe")
+        for directory in self.search_paths + [self.directory]:
+            yield (os.path.join(directory, "ffmpeg" + executable_suffix),
+                   os.path.join(directory, "ffprobe" + executable_suffix))
+
+    def find(self):
+        for ffmpeg, ffprobe in self.candidates():
+            if ffmpeg is None or ffprobe is None or not os.path.isfile(ffmpeg) or not os.path.isfile(ffprobe):
+                continue
+            version = self.check(ffmpeg, ffprobe)
+            if version is not None:
+                ffmpeg, ffprobe = os.path.abspath(ffmpeg), os.path.abspath(ffprobe)
+                self.save_cache(ffmpeg, ffprobe, version)
+                return ffmpeg, ffprobe, version
+        return None
+
+    def check(self, ffmpeg, ffprobe):
+        """Version of ffmpeg if both tools run and are new enough, None otherwise"""
+        versions = []
+        for tool in (ffmpeg, ffprobe):
+            try:
+                result = subprocess.run(
+                    [tool, "-version"],
+                    capture_output=True,
+                    text=True,
+                    timeout=10,
+                    creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+                )
+            except (OSError, subprocess.TimeoutExpired):
+                self.logger.warning(f"Could not run {tool}", exc_info=True)
+                return None
+            if result.returncode != 0:
+                self.logger.warning(f"{tool} -version failed with return code {result.returncode}")
+                return None
+            versions.append(result.stdout.split("\n", 1)[0])
+
+        match = version_regex.search(versions[0])
+        version = match.group(1) if match is not None else versions[0]
+        number = number_regex.match(version)
+        if number is not None and (int(number.group(1)), int(number.group(2))) < minimum_version:
+            self.logger.warning(f"{ffmpeg} is too old: {versions[0]}")
+            return None
+        return version
+
+    def download(self):
+        if self.url is None:
+            raise FileNotFoundError("ffmpeg and ffprobe were not found, install them or set FFMPEG_URL")
+
+        os.makedirs(self.directory, exist_ok=True)
+        url = self.url if "://" in self.url else pathlib.Path(self.url).absolute().as_uri()
+        archive_name = os.path.basename(urllib.request.url2pathname(url.rsplit("/", 1)[-1]))
+        archive_path = os.path.join(self.directory, archive_name)
+
+        self.logger.info(f"ffmpeg or ffprobe not found, downloading {url}")
+        self.fetch(url, archive_path + ".part")
+        self.verify_checksum(url, archive_path + ".part", archive_name)
+        os.replace(archive_path + ".part", archive_path)
+
+        try:
+            ffmpeg, ffprobe = self.extract(archive_path)
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(archive_path)
+
+        version = self.check(ffmpeg, ffprobe)
+        if version is None:
+            raise RuntimeError(f"The ffmpeg downloaded from {url} does not work")
+        self.save_cache(ffmpeg, ffprobe, version)
+        self.logger.info("Downloaded ffmpeg successfully.")
+        return ffmpeg, ffprobe, version
+
+    def fetch(self, url, part_path, chunk_size=1024 * 1024):
+        """Download url to part_path, continuing a previous partial download if the server supports it"""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request = urllib.request.Request(url)
+        if offset and url.startswith(("http://", "https://")):
+            request.add_header("Range", f"bytes={offset}-")
+
+        try:
+            response = urllib.request.urlopen(request, timeout=30)
+        except urllib.error.HTTPError as e:
+            # The part file is already complete
+            if e.code != 416:
+                raise
+            return
+
+        with response:
+            if getattr(response, "status", None) == 206:
+                self.logger.info(f"Resuming download at {offset / 1024 / 1024:.0f}MB")
+                mode = 'ab'
+            else:
+                mode = 'wb'
+            with open(part_path, mode) as f:
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+
+    def expected_sha256(self, url, archive_name):
+        if self.sha256:
+            return self.sha256
+
+        # Releases of the default builds list the checksums of all archives in checksums.sha256
+        checksums_url = url.rsplit("/", 1)[0] + "/checksums.sha256"
+        try:
+            with urllib.request.urlopen(checksums_url, timeout=30) as response:
+                checksums = response.read().decode("utf8", errors="replace")
+        except (OSError, ValueError):
+            return None
+        for line in checksums.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1].lstrip("*") == archive_name:
+                return parts[0].lower()
+        return None
+
+    def verify_checksum(self, url, path, archive_name):
+        expected = self.expected_sha256(url, archive_name)
+        if expected is None:
+            self.logger.warning(f"No checksum for {archive_name}, set FFMPEG_SHA256 to verify it")
+            return
+
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        if sha256.hexdigest() != expected:
+            # Start from scratch next time instead of resuming a broken file
+            os.remove(path)
+            raise RuntimeError(f"Checksum of {archive_name} does not match, expected {expected}")
+
+    def extract(self, archive_path):
+        """Extract the ffmpeg and ffprobe executables from a zip or tar archive into directory"""
+        names = {"ffmpeg" + executable_suffix, "ffprobe" + executable_suffix}
+        extracted = {}
+
+        def write(name, source):
+            destination = os.path.join(self.directory, name)
+            with open(destination + ".part", 'wb') as f:
+                shutil.copyfileobj(source, f)
+            if sys.platform != "win32":
+                os.chmod(destination + ".part", os.stat(destination + ".part").st_mode | stat.S_IXUSR)
+            os.replace(destination + ".part", destination)
+            extracted[name] = destination
+
+        if zipfile.is_zipfile(archive_path):
+            with zipfile.ZipFile(archive_path, 'r') as archive:
+                for member in archive.infolist():
+                    name = os.path.basename(member.filename)
+                    if name in names and name not in extracted:
+                        with archive.open(member) as source:
+                            write(name, source)
+        else:
+            with tarfile.open(archive_path, 'r:*') as archive:
+                for member in archive:
+                    name = os.path.basename(member.name)
+                    if member.isfile() and name in names and name not in extracted:
+                        with archive.extractfile(member) as source:
+                            write(name, source)
+
+        missing = names - set(extracted)
+        if missing:
+            raise FileNotFoundError(f"{', '.join(sorted(missing))} not found in {archive_path}")
+        return extracted["ffmpeg" + executable_suffix], extracted["ffprobe" + executable_suffix]
@@ -0,0 +1,138 @@
+"""Opt-in span tracing into a Chrome trace format file (chrome://tracing, ui.perfetto.dev)
+
+    with tracing.span("LogReader.read_events"):
+        ...
+
+Tracing is off unless start() is called (e.g. with --profile). A disabled span() only checks a flag and returns a
+shared no-op context manager, so the calls can stay in the hot paths.
+"""
+import json
+import os
+import threading
+import time
+
+enabled = False
+_writer = None
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_no_span = _NoSpan()
+
+
+class Span:
+    __slots__ = ("name", "category", "args", "start")
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        writer = _writer
+        if writer is not None:
+            if exc_type is not None:
+                self.args["error"] = exc_type.__name__
+            writer.add_span(self, end)
+        return False
+
+
+def span(name, category="app", **args):
+    """Context manager timing its block as a span, does nothing while tracing is disabled"""
+    if not enabled:
+        return _no_span
+    return Span(name, category, args)
+
+
+class TraceWriter:
+    """Collects finished spans and appends them to the trace file once a second
+
+    The file is a JSON array of trace events that is written incrementally, trace viewers accept it without the
+    closing bracket so a crash still leaves a readable trace behind.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.start = time.perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        self.lock = threading.Lock()
+        self.thread_names = {}
+
+        self.file = open(path, 'w')
+        self.file.write("[\n")
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="trace-writer", daemon=True)
+
+    def add_span(self, span, end):
+        thread = threading.current_thread()
+        event = {
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": round((span.start - self.start) * 1_000_000, 1),
+            "dur": round((end - span.start) * 1_000_000, 1),
+            "pid": self.pid,
+            "tid": thread.ident
+        }
+        if span.args:
+            event["args"] = span.args
+        with self.lock:
+            if thread.ident not in self.thread_names:
+                self.thread_names[thread.ident] = thread.name
+                self.events.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": thread.ident,
+                                    "args": {"name": thread.name}})
+            self.events.append(event)
+
+    def flush(self):
+        with self.lock:
+            events, self.events = self.events, []
+        if events:
+            self.file.write("".join(json.dumps(event, default=str) + ",\n" for event in events))
+            self.file.flush()
+
+    def run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.flush()
+        # Metadata event without a trailing comma closes the array
+        self.file.write(json.dumps({"name": "process_name", "ph": "M", "pid": self.pid,
+                                    "args": {"name": "Fight Recorder"}}) + "\n]\n")
+        self.file.close()
+
+
+def start(path):
+    """Enable tracing into path"""
+    global enabled, _writer
+    _writer = TraceWriter(path)
+    _writer.thread.start()
+    enabled = True
+    return _writer
+
+
+def stop():
+    global enabled, _writer
+    enabled = False
+    writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
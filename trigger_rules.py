@@ -0,0 +1,89 @@
+import re
+
+from combat_events import CombatEventKind
+
+default_rules = [
+    {"pattern": "(combat)"},
+    {"pattern": "has applied bonuses to"}
+]
+
+
+class TriggerRule:
+    """A single pattern from the TRIGGER_RULES setting
+
+    pattern: text (or a regex if literal is false) a gamelog line has to contain, regexes have to be ASCII and can
+        only use scoped flags like (?i:...) because all patterns are joined into one bytes regex
+    exclude: lines matching this rule never trigger, even if other rules match
+    weight: how much a matching line counts towards the trigger threshold, 0 only extends running recordings
+    extend: extra seconds the recording keeps running after a matching line
+    kind: only match lines parsed into this CombatEventKind (e.g. "DAMAGE_RECEIVED")
+    """
+
+    def __init__(self, pattern, literal=True, exclude=False, weight=1, extend=0, kind=None):
+        self.pattern = pattern
+        self.literal = literal
+        self.exclude = exclude
+        self.weight = float(weight)
+        self.extend = float(extend)
+        self.kind = CombatEventKind[kind] if kind is not None else None
+
+        if literal:
+            self.bytes_pattern = re.escape(pattern.encode("utf8"))
+            self.compiled = None
+        else:
+            # \w, \d, (?i:...) etc. only cover ASCII in the bytes regex, the line is checked with the same meaning
+            if not pattern.isascii():
+                raise ValueError(f"Trigger rule {pattern!r} is not ASCII, use a literal rule for other characters")
+            self.bytes_pattern = pattern.encode("ascii")
+            try:
+                # Compiled inside a group like in the joined regex, so a global flag like (?i) fails here already
+                re.compile(b"(?:" + self.bytes_pattern + b")")
+                self.compiled = re.compile(pattern, re.ASCII)
+            except re.error as e:
+                raise ValueError(f"Trigger rule {pattern!r} is not a valid regex: {e}") from e
+
+    def matches(self, line, event):
+        if self.kind is not None and (event is None or event.kind is not self.kind):
+            return False
+        if self.literal:
+            return self.pattern in line
+        return self.compiled.search(line) is not None
+
+
+class TriggerRules:
+    """All trigger rules compiled into a single matcher
+
+    The include patterns are joined into one bytes regex, so finding candidate lines is a single pass over the log
+    no matter how many rules there are. Only the (few) candidate lines are then checked against the individual rules.
+    """
+
+    def __init__(self, rules=None):
+        if not rules:
+            rules = default_rules
+        self.rules = [TriggerRule(**rule) for rule in rules]
+
+        include_patterns = [rule.bytes_pattern for rule in self.rules if not rule.exclude]
+        if not include_patterns:
+            # Nothing can trigger -> use a regex that never matches
+            include_patterns = [b"(?!)"]
+        self.regex = re.compile(b"|".join(b"(?:" + pattern + b")" for pattern in include_patterns))
+
+    def evaluate(self, line, event):
+        """Check a candidate line against all rules
+        :return (weight, extension) or None if the line should not trigger anything"""
+        matched = False
+        weight = 0
+        extension = 0
+        for rule in self.rules:
+            if not rule.matches(line, event):
+                continue
+            if rule.exclude:
+                return None
+
+            matched = True
+            weight = max(weight, rule.weight)
+            extension = max(extension, rule.extend)
+
+        if not matched:
+            return None
+        return weight, extension
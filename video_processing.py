@@ -1,15 +1,33 @@
+import collections
+import contextlib
+import json
 import os
+import subprocess
 import threading
 import time
 from enum import Enum
-import subprocess
-import sys
+
+import file_mover
+import low_priority
+import metrics
+import stitching
+import tracing
+from ffmpeg_progress import FfmpegProgress
+from job_scheduler import ActivityGate, JobScheduler
+
+ffmpeg_seconds = metrics.histogram("processing_ffmpeg_seconds", "Wall time of ffmpeg jobs")
+ffmpeg_bytes_per_second = metrics.histogram(
+    "processing_ffmpeg_bytes_per_second", "Output throughput of ffmpeg jobs",
+    buckets=tuple(2 ** power * 1024 * 1024 for power in range(12))
+)
+
 
 class ProcessingStatusCallback(Enum):
     PROCESSING_READY = 1
     PROCESSING_STARTED = 2
     PROCESSING_ENDED = 3
     PROCESSING_ERROR = 4
+    PROCESSING_PROGRESS = 5
 
 
 class ProcessingElement:
@@ -19,6 +37,33 @@ class ProcessingElement:
         self.output_dir = output_dir
         self.output_name = output_name
         self.renamed = False
+        self.replay_saved_at = None
+        self.recording_started_at = None
+        # waiting (for OBS) -> renamed -> concatenated -> done, or failed. Without concatenation renamed is done
+        self.state = "waiting"
+        self.concatenate = False
+
+    def as_dict(self):
+        return {
+            "replay_path": self.replay_path,
+            "recording_path": self.recording_path,
+            "output_dir": self.output_dir,
+            "output_name": self.output_name,
+            "renamed": self.renamed,
+            "replay_saved_at": self.replay_saved_at,
+            "recording_started_at": self.recording_started_at,
+            "concatenate": self.concatenate
+        }
+
+    @classmethod
+    def from_dict(cls, data, state):
+        video_element = cls(data["replay_path"], data["recording_path"], data["output_dir"], data["output_name"])
+        video_element.renamed = data["renamed"]
+        video_element.replay_saved_at = data["replay_saved_at"]
+        video_element.recording_started_at = data["recording_started_at"]
+        video_element.concatenate = data["concatenate"]
+        video_element.state = state
+        return video_element
 
     @property
     def extension(self):
@@ -39,115 +84,355 @@ class ProcessingElement:
 
 
 class VideoProcessingPipeline:
-    def __init__(self, auto_concatenate, delete, status_callback, logger, files_path, **kwargs):
+    def __init__(self, auto_concatenate, delete, status_callback, logger, files_path, file_timeout=120, workers=2,
+                 quiet_period=60, read_rate=0, ffmpeg="ffmpeg", ffprobe="ffprobe", tools=None, journal=None,
+                 library=None, gate=None, **kwargs):
         self.auto_concatenate = auto_concatenate
         self.delete = delete
         self.status_callback = status_callback
         self.logger = logger
         self.files_path = files_path
+        self.file_timeout = file_timeout
+        self.release_poll_max = 0.1
+        # ffmpeg reports its progress twice a second, the status only needs it every few seconds
+        self.progress_interval = 5
+        # Limit for ffmpeg reading its inputs as a multiple of real time, 0 reads as fast as possible
+        self.read_rate = read_rate
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+        # ToolProvisioner, its ffmpeg and ffprobe take the place of the two above once they are there
+        self.tools = tools
+        # One JSON line with throughput numbers per finished ffmpeg job
+        self.metrics_path = os.path.join(files_path, "processing_metrics.jsonl")
+        self.metrics_lock = threading.Lock()
+        # Shared with previous pipelines that might still be finishing their jobs
+        self.journal = journal
+        # Told about every file that lands in or leaves the output directory
+        self.library = library
+
+        # The listener closes the gate while recording and on every combat line, heavy jobs wait for it to open.
+        # A gate that is passed in is shared with pipelines before and after this one, it is not ours to release
+        self.owns_gate = gate is None
+        self.gate = gate if gate is not None else ActivityGate(quiet_period)
+
+        # All processing runs on a bounded pool so several fights in a row can't start unlimited ffmpeg processes
+        self.scheduler = JobScheduler(workers, logger, gate=self.gate)
 
         self.concatenate_candidate_elements = []
+        self.rename_jobs = {}
         self.status_callback(ProcessingStatusCallback.PROCESSING_READY)
 
-    def process(self, replay_path, recording_path, output_dir, output_name):
-        video_element = ProcessingElement(replay_path, recording_path, output_dir, output_name)
+    @property
+    def queue_depth(self):
+        return self.scheduler.queue_depth
+
+    def close(self):
+        """Finish all scheduled jobs in the background, no new ones can be added afterwards"""
+        # No fights are recorded for this pipeline anymore, nothing to wait for
+        if self.owns_gate:
+            self.gate.release()
+        self.scheduler.close()
+
+    def set_state(self, video_element, state):
+        video_element.state = state
+        if self.journal is not None:
+            self.journal.record(video_element.output_name, state, video_element.as_dict())
+
+    def process(self, session, output_dir):
+        """Schedule the processing of a fight: rename -> concatenate -> delete"""
+        video_element = ProcessingElement(None, None, output_dir, session.output_name)
+        video_element.concatenate = self.auto_concatenate
+        self.set_state(video_element, "waiting")
+
+        rename_job = self.scheduler.submit(
+            f"rename {video_element.output_name}", self.rename_session, session, video_element
+        )
+
+        self.rename_jobs[video_element.output_name] = rename_job
 
         if self.auto_concatenate:
-            self.concatenate_in_thread(video_element)
-            if not self.delete:
-                self.rename_in_thread(video_element)
+            self.schedule_concatenate(video_element)
         else:
-            self.rename_in_thread(video_element)
             self.concatenate_candidate_elements.append(video_element)
 
+    def resume(self):
+        """Schedule the work a previous run of the program left unfinished"""
+        if self.journal is None:
+            return
+
+        for entry in self.journal.unfinished():
+            video_element = ProcessingElement.from_dict(entry["data"], entry["state"])
+            self.logger.info(f"Resuming processing of {video_element.output_name} ({video_element.state})")
+
+            if video_element.state == "waiting":
+                if video_element.replay_path is None or video_element.recording_path is None:
+                    # OBS never reported the files, nobody can tell which ones belong to this fight anymore
+                    self.logger.warning(f"Files of fight {video_element.output_name} are unknown, giving up on it")
+                    self.set_state(video_element, "failed")
+                    continue
+                self.rename_jobs[video_element.output_name] = self.scheduler.submit(
+                    f"rename {video_element.output_name}", self.rename, video_element
+                )
+
+            if video_element.state == "concatenated":
+                self.schedule_delete(video_element, after=None)
+            elif video_element.concatenate:
+                self.schedule_concatenate(video_element)
+            else:
+                # Journals of older versions kept renamed fights without concatenation unfinished
+                if video_element.state == "renamed":
+                    self.set_state(video_element, "done")
+                self.concatenate_candidate_elements.append(video_element)
+
+    def schedule_concatenate(self, video_element):
+        if not video_element.concatenate:
+            video_element.concatenate = True
+            # A candidate was finished with its rename, it has work left again that a restart has to pick up
+            self.set_state(video_element, "renamed" if video_element.renamed else video_element.state)
+
+        after = self.rename_jobs.pop(video_element.output_name, None)
+        concatenate_job = self.scheduler.submit(
+            f"concatenate {video_element.output_name}", self.concatenate, video_element, after=after, heavy=True
+        )
+        self.schedule_delete(video_element, after=concatenate_job)
+
+    def schedule_delete(self, video_element, after):
+        if self.delete:
+            self.scheduler.submit(
+                f"delete {video_element.output_name}", self.delete_originals, video_element, after=after
+            )
+        elif video_element.state == "concatenated":
+            self.set_state(video_element, "done")
+
+    def rename_session(self, session, video_element):
+        """Wait for OBS to report the files of the fight as final, then move them to the output directory"""
+        if not session.wait(self.file_timeout):
+            self.logger.warning("OBS did not report all files of the fight in time, processing what we have.")
+
+        if session.replay_path is None or session.recording_path is None:
+            self.set_state(video_element, "failed")
+            self.status_callback((
+                ProcessingStatusCallback.PROCESSING_ERROR,
+                f"OBS did not report the files of fight {session.output_name}"
+            ))
+            raise FileNotFoundError(f"OBS did not report the files of fight {session.output_name}")
+
+        video_element.replay_path = session.replay_path
+        video_element.recording_path = session.recording_path
+        video_element.replay_saved_at = session.replay_saved_at
+        video_element.recording_started_at = session.recording_started_at
+        # Remember the files before touching them, a restart can finish the rename from here
+        self.set_state(video_element, "waiting")
+        self.rename(video_element)
+
     def rename(self, video_element):
         if os.path.exists(video_element.replay_path):
-            os.rename(video_element.replay_path, video_element.replay_destination)
+            self.rename_when_released(video_element.replay_path, video_element.replay_destination)
 
         if os.path.exists(video_element.recording_path):
-            # File still in use by OBS
-            while True:
-                try:
-                    os.rename(video_element.recording_path, video_element.recording_destination)
-                    break
-                except PermissionError:
-                    time.sleep(10)
-
-    def rename_in_thread(self, video_element):
-        rename_thread = threading.Thread(target=self.rename, args=(video_element,))
-        rename_thread.start()
+            self.rename_when_released(video_element.recording_path, video_element.recording_destination)
+
+        video_element.renamed = True
+        # Without concatenation the fight is finished here, it stays a candidate until the program exits
+        self.set_state(video_element, "renamed" if video_element.concatenate else "done")
+        if self.library is not None:
+            self.library.add(video_element.replay_destination)
+            self.library.add(video_element.recording_destination)
+
+    def rename_when_released(self, source, destination):
+        """Rename a file as soon as OBS lets go of it, it is copied if the output directory is on another drive
+
+        OBS reported the file as done already, but on Windows it can take a moment until its handle is closed.
+        Retry quickly at first and back off up to release_poll_max, giving up after file_timeout.
+        """
+        deadline = time.monotonic() + self.file_timeout
+        delay = 0.005
+        while True:
+            try:
+                start = time.perf_counter()
+                if file_mover.move(source, destination, self.move_progress(source)):
+                    duration = time.perf_counter() - start
+                    size = os.path.getsize(destination)
+                    self.logger.info(f"Copied {source} to another drive in {duration:.1f}s "
+                                     f"({size / max(duration, 1e-6) / 1024 / 1024:.1f}MB/s)")
+                return
+            except PermissionError:
+                if time.monotonic() + delay > deadline:
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 2, self.release_poll_max)
+
+    def move_progress(self, source):
+        """Progress callback for copying a file to another drive, the copy pauses while there is combat"""
+        last_report = time.monotonic()
+
+        def progress(copied, total):
+            nonlocal last_report
+            if not self.gate.is_open():
+                self.logger.info(f"Pausing copy of {source} until combat is over")
+                self.gate.wait_open()
+            if time.monotonic() - last_report >= 5:
+                last_report = time.monotonic()
+                self.logger.info(f"Copying {source}: {copied / total * 100:.0f}%")
+
+        return progress
+
+    def inputs(self, video_element):
+        if video_element.renamed:
+            return video_element.replay_destination, video_element.recording_destination
+        return video_element.replay_path, video_element.recording_path
 
     def concatenate(self, video_element):
         self.status_callback(ProcessingStatusCallback.PROCESSING_STARTED)
 
-        concat_directory = os.path.join(self.files_path, "concat.txt")
+        # Every job gets its own list so concurrent jobs don't overwrite each other's inputs
+        concat_directory = os.path.join(self.files_path, f"concat_{video_element.output_name}.txt")
+        replay_input, recording_input = self.inputs(video_element)
 
-        if video_element.renamed:
-            replay_input = video_element.replay_destination
-            recording_input = video_element.recording_destination
-        else:
-            replay_input = video_element.replay_path
-            recording_input = video_element.recording_path
+        if not os.path.exists(replay_input) or not os.path.exists(recording_input):
+            self.logger.error("Could not start processing because input files did not exist!")
+            self.set_state(video_element, "failed")
+            raise FileNotFoundError("Input files for concatenation did not exist")
 
         try:
-            with open(concat_directory, 'w') as concat_file:
-                if not os.path.exists(replay_input) or \
-                        not os.path.exists(recording_input):
-                    self.logger.error("Could not start processing because input files did not exist!")
-                    return
+            ffmpeg, ffprobe = self.binaries()
+        except Exception as e:
+            self.concatenate_failed(video_element)
+            self.status_callback((ProcessingStatusCallback.PROCESSING_ERROR, e))
+            raise
 
-                concat_file.writelines([
-                    f"file '{replay_input}'\n",
-                    f"file '{recording_input}'"
-                ])
+        with tracing.span("ffprobe stitch plan", "ffmpeg"):
+            plan = self.plan_stitch(ffprobe, video_element, replay_input, recording_input)
+        progress = FfmpegProgress(f"concatenate {video_element.output_name}", plan.duration)
+
+        try:
+            stitching.write_concat_list(concat_directory, replay_input, recording_input, plan.inpoint)
 
             command = [
-                "ffmpeg",
+                ffmpeg,
+                "-nostats",
+                "-progress", "pipe:1",
                 "-f", "concat",
-                "-safe", "0",
+                "-safe", "0"
+            ]
+            if self.read_rate:
+                command += ["-readrate", str(self.read_rate)]
+            command += [
                 "-i", concat_directory,
                 "-c", "copy",
                 video_element.concatenated_destination
             ]
 
-            creation_flags = 0
-            if sys.platform == "win32":
-                creation_flags = subprocess.CREATE_NO_WINDOW
-
-            process = subprocess.Popen(
+            process = low_priority.popen(
                 command,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,
-                creationflags=creation_flags
+                text=True
             )
 
-            _, stderr = process.communicate()
-            if process.returncode != 0:
-                self.status_callback((ProcessingStatusCallback.PROCESSING_ERROR, stderr))
-                return
+            with tracing.span("ffmpeg concat", "ffmpeg", output=video_element.concatenated_destination):
+                stderr = self.wait_for_process(process, progress)
+        except Exception as e:
+            self.concatenate_failed(video_element)
+            self.status_callback((ProcessingStatusCallback.PROCESSING_ERROR, e))
+            raise
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(concat_directory)
 
-            os.remove(concat_directory)
+        progress.finish()
+        self.write_metrics(progress, process.returncode)
+        ffmpeg_seconds.observe(progress.wall_time)
+        ffmpeg_bytes_per_second.observe(progress.bytes_per_second)
 
-            if self.delete:
-                os.remove(replay_input)
-                os.remove(recording_input)
+        # Failing here also cancels deleting the originals
+        if process.returncode != 0:
+            self.concatenate_failed(video_element)
+            self.status_callback((ProcessingStatusCallback.PROCESSING_ERROR, stderr))
+            raise RuntimeError(f"ffmpeg failed with return code {process.returncode}")
 
-            self.status_callback(ProcessingStatusCallback.PROCESSING_ENDED)
-        except Exception as e:
-            self.status_callback((ProcessingStatusCallback.PROCESSING_ERROR, e))
+        self.set_state(video_element, "concatenated" if self.delete else "done")
+        if self.library is not None:
+            self.library.add(video_element.concatenated_destination)
+        self.logger.info(f"Finished {progress} in {progress.wall_time:.1f}s")
+        self.status_callback(ProcessingStatusCallback.PROCESSING_ENDED)
 
-    def concatenate_in_thread(self, video_element):
-        video_processing_thread = threading.Thread(target=self.concatenate, args=(video_element,))
-        video_processing_thread.start()
+    def concatenate_failed(self, video_element):
+        """Keep the fight as a candidate, concatenating it manually can try again"""
+        video_element.concatenate = False
+        # Not retried after a restart, the files are not in use anymore
+        self.set_state(video_element, "failed")
+        self.concatenate_candidate_elements.append(video_element)
 
-    def concatenate_candidates(self, concatenate_candidate_elements):
-        for video_element in concatenate_candidate_elements:
-            self.concatenate(video_element)
+    def binaries(self):
+        """ffmpeg and ffprobe to run, waits for them if they are still being downloaded"""
+        if self.tools is None:
+            return self.ffmpeg, self.ffprobe
+        return self.tools.wait()
 
-    def concatenate_candidates_in_thread(self):
-        video_processing_thread = threading.Thread(
-            target=self.concatenate_candidates,
-            args=(self.concatenate_candidate_elements,)
-        )
-        video_processing_thread.start()
+    def plan_stitch(self, ffprobe, video_element, replay_input, recording_input):
+        """Where to cut the recording so it continues the replay buffer and how long the result will be"""
+        try:
+            plan = stitching.plan_stitch(
+                ffprobe, replay_input, recording_input,
+                video_element.replay_saved_at, video_element.recording_started_at
+            )
+        except Exception:
+            # Worst case the overlap stays in the video, not worth failing the concatenation for
+            self.logger.warning("Could not find the overlap of replay and recording", exc_info=True)
+            return stitching.StitchPlan(None, None)
+
+        if plan.inpoint is not None:
+            self.logger.info(f"Starting the recording of {video_element.output_name} at {plan.inpoint:.3f}s")
+        return plan
+
+    def read_progress(self, stream, progress):
+        """Background thread parsing the -progress output of ffmpeg"""
+        last_reported = None
+        for line in stream:
+            if progress.feed(line):
+                now = time.monotonic()
+                if last_reported is None or now - last_reported >= self.progress_interval:
+                    last_reported = now
+                    self.status_callback((ProcessingStatusCallback.PROCESSING_PROGRESS, progress))
+
+    def write_metrics(self, progress, returncode):
+        metrics = progress.as_dict()
+        metrics["time"] = time.time()
+        metrics["returncode"] = returncode
+        try:
+            with self.metrics_lock, open(self.metrics_path, 'a') as f:
+                f.write(json.dumps(metrics) + "\n")
+        except OSError:
+            self.logger.warning("Could not write processing metrics", exc_info=True)
+
+    def wait_for_process(self, process, progress):
+        """Wait for ffmpeg to finish, pausing it whenever a new fight starts, returns the end of its error output"""
+        # Only the last lines of stderr are kept, ffmpeg can write a lot for long videos
+        stderr = collections.deque(maxlen=50)
+        readers = [
+            threading.Thread(target=self.read_progress, args=(process.stdout, progress), daemon=True),
+            threading.Thread(target=stderr.extend, args=(process.stderr,), daemon=True)
+        ]
+        for reader in readers:
+            reader.start()
+
+        low_priority.wait(process, self.gate, self.logger)
+        for reader in readers:
+            reader.join()
+        return "".join(stderr)
+
+    def delete_originals(self, video_element):
+        """Only runs after a successful concatenation"""
+        for input_path in self.inputs(video_element):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(input_path)
+            if self.library is not None:
+                self.library.remove(input_path)
+        self.set_state(video_element, "done")
+
+    def concatenate_candidates(self):
+        # Every candidate is only scheduled once, failed ones come back as candidates
+        candidates, self.concatenate_candidate_elements = self.concatenate_candidate_elements, []
+        for video_element in candidates:
+            self.schedule_concatenate(video_element)
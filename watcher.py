@@ -0,0 +1,110 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import threading
+
+
+class PollingWatcher:
+    """Fallback watcher that simply sleeps, the caller is responsible for polling the directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.wake_event = threading.Event()
+
+    def wait(self, timeout):
+        """Wait for up to timeout seconds, return true if the directory might have changed"""
+        self.wake_event.wait(timeout)
+        self.wake_event.clear()
+        return True
+
+    def wake(self):
+        """Let a waiting wait() return right away"""
+        self.wake_event.set()
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Watch a directory with linux inotify so we wake up as soon as a log file is written to"""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # wake() writes to this pipe to interrupt select, the lock keeps it from writing to a closed (and maybe
+        # reused) fd number
+        self.wake_lock = threading.Lock()
+        self.wake_read, self.wake_write = os.pipe()
+        # Neither end may block, wake() holds the lock while it writes
+        os.set_blocking(self.wake_read, False)
+        os.set_blocking(self.wake_write, False)
+
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            for fd in (self.fd, self.wake_read, self.wake_write):
+                os.close(fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout):
+        """Block until the directory is written to or timeout seconds passed,
+        return true if the directory changed"""
+        readable, _, _ = select.select([self.fd, self.wake_read], [], [], timeout)
+        if self.wake_read in readable:
+            try:
+                os.read(self.wake_read, 4096)
+            except BlockingIOError:
+                pass
+        if self.fd not in readable:
+            return False
+
+        # Drain all pending events, we only care that something happened
+        try:
+            while os.read(self.fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def wake(self):
+        """Let a waiting wait() return right away, does nothing once the watcher is closed"""
+        with self.wake_lock:
+            if self.wake_write < 0:
+                return
+            try:
+                os.write(self.wake_write, b"\0")
+            except BlockingIOError:
+                # The pipe is full, wait() wakes up anyway
+                pass
+
+    def close(self):
+        with self.wake_lock:
+            if self.fd >= 0:
+                os.close(self.fd)
+                os.close(self.wake_read)
+                os.close(self.wake_write)
+                self.fd = self.wake_read = self.wake_write = -1
+
+
+def create_watcher(directory):
+    """Create the best available watcher for this platform, falling back to polling"""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError, TypeError):
+            pass
+    return PollingWatcher(directory)